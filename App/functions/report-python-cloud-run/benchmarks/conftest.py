@@ -0,0 +1,51 @@
+"""Offline benchmark setup: synthetic Zarr stores, a local STAC catalog, the
+stub LLM and basemaps from an empty offline tile cache"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).parent.parent
+BENCHMARK_DIR = Path(os.getenv("BENCHMARK_DIR", Path(tempfile.gettempdir()) / "gca-benchmark"))
+# number of stations in each synthetic store
+BENCHMARK_STATIONS = int(os.getenv("BENCHMARK_STATIONS", "100000"))
+
+# the settings are read when the report modules are imported
+os.environ.update(
+    LLM_BACKEND="stub",
+    LLM_CACHE_BACKEND="memory",
+    BASEMAP_OFFLINE="1",
+    BASEMAP_CACHE_DIR=str(BENCHMARK_DIR / "basemap-tiles"),
+    STATION_INDEX_DIR=str(BENCHMARK_DIR / "station-index"),
+    # every round has to build the report rather than read it from the cache
+    REPORT_CACHE_MEMORY_BYTES="0",
+    REPORT_CACHE_DISK_BYTES="0",
+)
+os.environ.setdefault("PLOT_WORKERS", "0")
+
+# the report package imports its modules as top-level utils and datasets
+sys.path.insert(0, str(APP_DIR))
+sys.path.append(str(APP_DIR / "report"))
+
+import synthetic  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stores() -> dict[str, Path]:
+    root = BENCHMARK_DIR / f"stores-{BENCHMARK_STATIONS}"
+    if not (root / "catalog.json").exists():
+        stores = synthetic.write_stores(root, BENCHMARK_STATIONS)
+        synthetic.write_catalog(root, stores)
+    return {dataset_id: root / f"{dataset_id}.zarr" for dataset_id in synthetic.DATASETS}
+
+
+@pytest.fixture(scope="session")
+def stac_root(stores) -> str:
+    return str(next(iter(stores.values())).parent / "catalog.json")
+
+
+@pytest.fixture(params=list(synthetic.POLYGON_SIZES))
+def polygon(request):
+    return synthetic.benchmark_polygon(request.param)
@@ -0,0 +1,36 @@
+import importlib
+
+import pytest
+import rioxarray  # noqa: F401
+import xarray as xr
+
+# STAC collection id -> dataset module and content function
+CONTENT_FUNCTIONS = {
+    "shore_mon": ("shoremon", "get_shoremon_content"),
+    "sed_class": ("shoremon", "get_sedclass_content"),
+    "world_pop": ("popgpd", "get_world_pop_content"),
+    "shore_mon_fut": ("shoremon", "get_shoremon_fut_content"),
+    "esl_gwl": ("esl", "get_esl_content"),
+}
+
+
+@pytest.mark.parametrize("dataset_id", list(CONTENT_FUNCTIONS))
+def test_get_content(benchmark, stores, polygon, dataset_id):
+    from utils.zarr_slicing import ZarrSlicer, get_station_index
+
+    module_name, function_name = CONTENT_FUNCTIONS[dataset_id]
+    get_content = getattr(importlib.import_module(f"datasets.{module_name}"), function_name)
+
+    url = str(stores[dataset_id])
+    xarr = xr.open_zarr(url)
+    sliced = ZarrSlicer.slice_xarr_with_polygon(xarr, polygon, get_station_index(url, xarr))
+    sliced = sliced.rio.write_crs("EPSG:4326")
+
+    # some plot functions add variables to their input, give each round a copy
+    content = benchmark.pedantic(
+        get_content,
+        setup=lambda: ((sliced.copy(deep=True),), {}),
+        rounds=5,
+    )
+
+    assert content
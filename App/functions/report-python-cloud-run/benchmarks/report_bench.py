@@ -0,0 +1,25 @@
+import pytest
+
+
+@pytest.fixture
+def report(monkeypatch, stac_root):
+    from report import report
+
+    monkeypatch.setattr(report, "STAC_ROOT_DEFAULT", stac_root)
+    # sea level rise projections are read from remote COGs, leave them out
+    monkeypatch.setattr(report, "get_slr_content", lambda polygon: None)
+    return report
+
+
+def test_generate_report_content(benchmark, report, polygon):
+    report_content = benchmark.pedantic(report.generate_report_content, args=(polygon,), rounds=3)
+
+    assert report_content.datasets
+
+
+def test_create_report_pdf(benchmark, report, polygon):
+    html = report.render_report_html(polygon)
+
+    pdf = benchmark.pedantic(report.create_report_pdf, args=(html,), rounds=3)
+
+    assert pdf.getvalue().startswith(b"%PDF")
@@ -0,0 +1,17 @@
+import pytest
+import xarray as xr
+
+from synthetic import DATASETS
+
+
+@pytest.mark.parametrize("dataset_id", list(DATASETS))
+def test_slice_xarr_with_polygon(benchmark, stores, polygon, dataset_id):
+    from utils.zarr_slicing import ZarrSlicer, get_station_index
+
+    url = str(stores[dataset_id])
+    xarr = xr.open_zarr(url)
+    station_index = get_station_index(url, xarr)
+
+    sliced = benchmark(ZarrSlicer.slice_xarr_with_polygon, xarr, polygon, station_index)
+
+    assert ZarrSlicer.check_xarr_contains_data(sliced)
@@ -0,0 +1,160 @@
+"""Synthetic Zarr stores shaped like the GCA datasets and a local STAC catalog
+pointing at them
+
+The stations lie along a synthetic coastline across the North Sea, so the
+benchmark polygons select a number of stations proportional to their size.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pystac
+import shapely  # type: ignore
+import xarray as xr
+
+# synthetic coastline lat = COAST_LAT + COAST_AMPLITUDE * sin(lon), for lon in COAST_LON
+COAST_LON = (2.0, 8.0)
+COAST_LAT = 53.0
+COAST_AMPLITUDE = 0.5
+STATION_CHUNK = 5000
+
+# half widths in degrees of the benchmark polygons, centred on the coastline
+POLYGON_SIZES = {"small": 0.1, "medium": 0.5, "large": 2.0}
+
+
+def coastline_stations(n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """lon/lat of n stations scattered around the synthetic coastline"""
+    rng = np.random.default_rng(seed)
+    lons = np.sort(rng.uniform(*COAST_LON, n))
+    lats = COAST_LAT + COAST_AMPLITUDE * np.sin(lons) + rng.normal(0, 0.01, n)
+    return lons, lats
+
+
+def benchmark_polygon(size: str) -> shapely.Polygon:
+    lon = np.mean(COAST_LON)
+    lat = COAST_LAT + COAST_AMPLITUDE * np.sin(lon)
+    half_width = POLYGON_SIZES[size]
+    return shapely.box(lon - half_width, lat - half_width, lon + half_width, lat + half_width)
+
+
+def _stations_dataset(n: int, data_vars: dict, seed: int = 0, **coords) -> xr.Dataset:
+    lons, lats = coastline_stations(n, seed)
+    return xr.Dataset(
+        data_vars,
+        coords={
+            "lon": ("stations", lons, {"long_name": "longitude", "units": "degrees_east"}),
+            "lat": ("stations", lats, {"long_name": "latitude", "units": "degrees_north"}),
+            **coords,
+        },
+    )
+
+
+def make_shoreline_monitor(n: int) -> xr.Dataset:
+    rng = np.random.default_rng(1)
+    return _stations_dataset(
+        n,
+        {
+            "changerate": (
+                "stations",
+                rng.normal(0, 2, n),
+                {"long_name": "shoreline change rate", "units": "m/yr"},
+            )
+        },
+    )
+
+
+def make_sed_class(n: int) -> xr.Dataset:
+    rng = np.random.default_rng(2)
+    return _stations_dataset(
+        n,
+        {
+            "sediment_label": (
+                "stations",
+                rng.integers(0, 5, n),
+                {"long_name": "sediment class"},
+            )
+        },
+    )
+
+
+def make_world_pop(n: int) -> xr.Dataset:
+    rng = np.random.default_rng(3)
+    return _stations_dataset(
+        n,
+        {
+            "pop_tot": (
+                "stations",
+                rng.lognormal(8, 1, n),
+                {"long_name": "total population"},
+            )
+        },
+    )
+
+
+def make_shore_mon_fut(n: int) -> xr.Dataset:
+    rng = np.random.default_rng(4)
+    time = pd.to_datetime(["2021-01-01", "2050-01-01", "2100-01-01"])
+    # cumulative shoreline position relative to 2021
+    positions = {
+        var: (
+            ("stations", "time"),
+            np.cumsum(rng.normal(0, 50, (n, len(time))), axis=1) * [0, 1, 1],
+            {"long_name": f"shoreline position {var}", "units": "m"},
+        )
+        for var in ("sp_rcp45_p50", "sp_rcp85_p50")
+    }
+    return _stations_dataset(n, positions, time=time)
+
+
+def make_esl(n: int) -> xr.Dataset:
+    rng = np.random.default_rng(5)
+    gwl = [1.5, 3.0, 5.0]
+    rp = [1.0, 10.0, 50.0, 100.0]
+    ensemble = [5, 50, 95]
+    esl = np.sort(rng.uniform(1, 4, (n, len(gwl), len(rp), len(ensemble))), axis=-1)
+    return _stations_dataset(
+        n,
+        {"esl": (("stations", "gwl", "rp", "ensemble"), esl, {"long_name": "extreme sea level", "units": "m"})},
+        gwl=gwl,
+        rp=rp,
+        ensemble=ensemble,
+    )
+
+
+# STAC collection id -> generator
+DATASETS = {
+    "shore_mon": make_shoreline_monitor,
+    "sed_class": make_sed_class,
+    "world_pop": make_world_pop,
+    "shore_mon_fut": make_shore_mon_fut,
+    "esl_gwl": make_esl,
+}
+
+
+def write_stores(root: Path, n: int) -> dict[str, Path]:
+    """Write all synthetic datasets with n stations as Zarr stores under root"""
+    stores = {}
+    for dataset_id, make_dataset in DATASETS.items():
+        path = root / f"{dataset_id}.zarr"
+        make_dataset(n).chunk({"stations": STATION_CHUNK}).to_zarr(path, mode="w", consolidated=True)
+        stores[dataset_id] = path
+    return stores
+
+
+def write_catalog(root: Path, stores: dict[str, Path]) -> Path:
+    """Write a STAC catalog with a collection per store, returns the path of
+    catalog.json"""
+    catalog = pystac.Catalog(id="gca-benchmark", description="Synthetic GCA datasets")
+    extent = pystac.Extent(
+        pystac.SpatialExtent([[COAST_LON[0], COAST_LAT - 1, COAST_LON[1], COAST_LAT + 1]]),
+        pystac.TemporalExtent([[None, None]]),
+    )
+    for dataset_id, path in stores.items():
+        collection = pystac.Collection(id=dataset_id, description=dataset_id, extent=extent)
+        collection.add_asset(
+            "data", pystac.Asset(href=str(path), media_type="application/vnd+zarr")
+        )
+        catalog.add_child(collection)
+
+    catalog.normalize_and_save(str(root), catalog_type=pystac.CatalogType.SELF_CONTAINED)
+    return root / "catalog.json"
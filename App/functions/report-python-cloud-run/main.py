@@ -3,16 +3,44 @@ import os
 
 from shapely import Polygon  # type: ignore
 from shapely.geometry import shape  # type: ignore
-from flask import Flask, make_response, render_template_string, request
+from flask import (
+    Flask,
+    Response,
+    abort,
+    jsonify,
+    make_response,
+    render_template_string,
+    request,
+    send_file,
+    send_from_directory,
+    stream_with_context,
+    url_for,
+)
 
 from report.report import (
+    BuiltReport,
+    build_report,
     create_report_html,
-    create_report_pdf,
+    create_report_pdf_file,
+    get_cached_report_html,
+    stream_report_html,
+    get_render_context,
+    polygon_key,
+    FIGURE_ASSET_DIR,
     POLYGON_DEFAULT,
     STAC_ROOT_DEFAULT,
+    # the metrics module as imported by the report package
+    metrics,
+    trace_report,
+    REPORT_METRICS_HEADER,
 )
+from report.utils.jobs import JobQueue, JobStatus
 
 app = Flask(__name__)
+job_queue = JobQueue(build_report, on_expire=BuiltReport.discard)
+
+# compile the templates and parse the stylesheet before the first request
+get_render_context()
 
 
 @app.route("/", methods=["GET"])
@@ -35,19 +63,24 @@ def return_report():
     if not isinstance(polygon, Polygon):
         raise ValueError("Invalid polygon")
 
-    web_page_content = create_report_html(polygon=polygon, stac_root=stac_root)
-    pdf_object = create_report_pdf(web_page_content)
+    with trace_report() as trace:
+        web_page_content = create_report_html(polygon=polygon, stac_root=stac_root)
+        pdf_file = create_report_pdf_file(web_page_content)
 
-    response = make_response(pdf_object.getvalue())
-    response.headers["Content-Type"] = "application/pdf"
-    response.headers["Content-Disposition"] = "inline; filename=coastal_report.pdf"
+    # stream the PDF in chunks, the file is closed once it has been sent
+    response = send_file(
+        pdf_file, mimetype="application/pdf", download_name="coastal_report.pdf"
+    )
     response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
+    if REPORT_METRICS_HEADER:
+        response.headers["X-Report-Metrics"] = trace.to_json()
     return response
 
 
 @app.route("/html")
 def return_html():
-    """Return a report for the given polygon"""
+    """Return a report for the given polygon. With ?stream=true the html is
+    sent in chunks, each section as soon as it is ready"""
     polygon_str = request.args.get("polygon")
 
     if not polygon_str:
@@ -65,10 +98,119 @@ def return_html():
     if not isinstance(polygon, Polygon):
         raise ValueError("Invalid polygon")
 
-    web_page_content = create_report_html(polygon=polygon, stac_root=stac_root)
+    stream = request.args.get("stream", "").lower() in ("1", "true", "yes")
+    if stream and get_cached_report_html(polygon) is None:
+
+        def generate():
+            with trace_report():
+                yield from stream_report_html(polygon)
+
+        response = Response(stream_with_context(generate()), mimetype="text/html")
+        # ask proxies not to buffer the chunks
+        response.headers["X-Accel-Buffering"] = "no"
+        response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
+        return response
+
+    with trace_report() as trace:
+        web_page_content = create_report_html(polygon=polygon, stac_root=stac_root)
 
     response = make_response(render_template_string(web_page_content))
     response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
+    if REPORT_METRICS_HEADER:
+        response.headers["X-Report-Metrics"] = trace.to_json()
+    return response
+
+
+@app.route("/assets/<name>")
+def get_asset(name: str):
+    """Return a figure from the asset store"""
+    if not FIGURE_ASSET_DIR:
+        abort(404)
+    # assets are content addressed and never change
+    return send_from_directory(FIGURE_ASSET_DIR, name, max_age=365 * 24 * 3600)
+
+
+@app.route("/metrics")
+def get_metrics():
+    """Return the report build metrics in the Prometheus text format"""
+    return make_response(
+        metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+    )
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue a report for the polygon in the request body, either a GeoJSON
+    polygon or an object with a "polygon" member"""
+    body = request.get_json(silent=True)
+    if body is not None and not isinstance(body, dict):
+        return make_response({"error": "Expected a GeoJSON polygon or an object with a polygon"}, 400)
+    geometry = body.get("polygon", body) if body else json.loads(POLYGON_DEFAULT)
+
+    polygon = shape(geometry)
+    if not isinstance(polygon, Polygon):
+        raise ValueError("Invalid polygon")
+
+    # identical polygons in flight share a job
+    job = job_queue.submit(polygon_key(polygon), polygon)
+
+    response = jsonify(
+        {**job.to_dict(), "status_url": url_for("get_job", job_id=job.job_id)}
+    )
+    response.status_code = 202
+    response.headers["Location"] = url_for("get_job", job_id=job.job_id)
+    response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
+    return response
+
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id: str):
+    """Return the status of a report job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return make_response({"error": "Unknown job"}, 404)
+
+    status = job.to_dict()
+    if job.status == JobStatus.DONE:
+        status["pdf_url"] = url_for("get_job_pdf", job_id=job_id)
+        status["html_url"] = url_for("get_job_html", job_id=job_id)
+
+    response = jsonify(status)
+    response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
+    return response
+
+
+@app.route("/jobs/<job_id>/pdf")
+def get_job_pdf(job_id: str):
+    """Return the PDF of a finished report job"""
+    job = job_queue.get(job_id)
+    if job is None or job.status != JobStatus.DONE:
+        return make_response({"error": "Report not available"}, 404)
+
+    # rendered by the job, the file is removed once the job expires
+    try:
+        pdf_file = open(job.result.pdf_path, "rb")
+    except FileNotFoundError:
+        return make_response({"error": "Report not available"}, 404)
+
+    response = send_file(
+        pdf_file,
+        mimetype="application/pdf",
+        download_name="coastal_report.pdf",
+    )
+    response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
+    return response
+
+
+@app.route("/jobs/<job_id>/html")
+def get_job_html(job_id: str):
+    """Return the html of a finished report job"""
+    job = job_queue.get(job_id)
+    if job is None or job.status != JobStatus.DONE:
+        return make_response({"error": "Report not available"}, 404)
+
+    response = make_response(render_template_string(job.result.html))
+    response.headers["Access-Control-Allow-Origin"] = "*"  # CORS
     return response
 
 
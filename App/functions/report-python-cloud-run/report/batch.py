@@ -0,0 +1,240 @@
+"""Build the reports of a batch of areas of interest
+
+    python batch.py ../data/deltas.geojson --output-dir ../reports --workers 4
+
+The areas are read from a GeoJSON FeatureCollection, Feature or geometry, or
+from a file with one of those per line. The report of each area is written to
+``<output-dir>/<name>.html`` and ``<name>.pdf``, named by the ``name`` property
+of its feature, its id or else its position in the file.
+
+The reports are built in a pool of worker processes. Each worker loads the
+catalog, opens the Zarr stores with their station indexes and loads the world
+boundaries once, and reuses them for every area it builds. The chunk, station
+index, basemap and LLM caches on disk are shared by all workers.
+
+Finished areas are recorded in ``<output-dir>/progress.jsonl``; a rerun skips
+the areas that were built and retries the ones that failed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from shapely import Polygon  # type: ignore
+from shapely.geometry import shape  # type: ignore
+
+from utils.report_cache import polygon_key
+
+PROGRESS_FILE = "progress.jsonl"
+
+
+@dataclass
+class AOI:
+    name: str
+    polygon: Polygon
+
+
+def safe_name(name: str) -> str:
+    """File name for an area name"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("._")
+
+
+def read_aois(path: Path, name_property: str = "name") -> list[AOI]:
+    """Read the areas of interest in a GeoJSON file
+
+    Args:
+        path (Path): GeoJSON FeatureCollection, Feature or geometry, or a file
+            with one of those per line
+        name_property (str, optional): feature property holding the area name
+
+    Returns:
+        list[AOI]: areas in the order of the file
+
+    Raises:
+        ValueError: an area is not a polygon or its name is not unique
+    """
+    text = path.read_text()
+    try:
+        objects = [json.loads(text)]
+    except json.JSONDecodeError:
+        objects = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    features = []
+    for obj in objects:
+        if obj.get("type") == "FeatureCollection":
+            features.extend(obj["features"])
+        elif obj.get("type") == "Feature":
+            features.append(obj)
+        else:
+            features.append({"type": "Feature", "geometry": obj})
+
+    aois = []
+    names = set()
+    for i, feature in enumerate(features):
+        name = (feature.get("properties") or {}).get(name_property) or feature.get("id")
+        name = safe_name(str(name)) if name is not None else ""
+        name = name or f"aoi-{i}"
+        if name in names:
+            raise ValueError(f"Duplicate area name {name} in {path}")
+        names.add(name)
+        polygon = shape(feature["geometry"])
+        # fail before building anything rather than on this area
+        if not isinstance(polygon, Polygon):
+            raise ValueError(f"Area {name} in {path} is a {polygon.geom_type}, expected a Polygon")
+        aois.append(AOI(name=name, polygon=polygon))
+    return aois
+
+
+def load_progress(output_dir: Path) -> dict[str, dict]:
+    """Latest progress record of each area in output_dir"""
+    path = output_dir / PROGRESS_FILE
+    progress = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of an interrupted run
+                continue
+            progress[record["name"]] = record
+    return progress
+
+
+def is_built(aoi: AOI, record: Optional[dict], output_dir: Path) -> bool:
+    """Whether the report of aoi was built for the same polygon by an earlier run"""
+    return (
+        record is not None
+        and record["status"] == "done"
+        and record["polygon_key"] == polygon_key(aoi.polygon)
+        and (output_dir / f"{aoi.name}.html").exists()
+        and (output_dir / f"{aoi.name}.pdf").exists()
+    )
+
+
+def _warm_up():
+    """Initialise a batch worker: load the state shared by all its reports"""
+    # imported here so the helpers above can be used without the report stack
+    from report import STAC_ROOT_DEFAULT
+    from utils.render_context import get_render_context
+    from utils.stac import get_zarr_datasets
+    from utils.zarr_slicing import ZarrSlicer, get_station_index
+    from datasets.world import get_world_boundary
+
+    try:
+        for zarr_dataset in get_zarr_datasets(STAC_ROOT_DEFAULT):
+            # the multiscale levels are read for the figures of large areas
+            urls = [zarr_dataset.zarr_uri] + [
+                f"{zarr_dataset.zarr_uri.rstrip('/')}/{level['path']}" for level in zarr_dataset.multiscales
+            ]
+            for url in urls:
+                xarr = ZarrSlicer._get_dataset_from_zarr_url(url)
+                get_station_index(url, xarr)
+        get_world_boundary()
+        get_render_context()
+    except Exception as e:
+        # the reports load what is missing themselves
+        print(f"failed to warm up batch worker: {e}")
+
+
+def build_aoi(aoi: AOI, output_dir: Path) -> float:
+    """Build the html and PDF report of aoi into output_dir
+
+    Returns:
+        float: seconds it took
+    """
+    from report import STAC_ROOT_DEFAULT, create_report_html, create_report_pdf_file
+
+    start = time.perf_counter()
+    html = create_report_html(polygon=aoi.polygon, stac_root=STAC_ROOT_DEFAULT)
+    html_path = output_dir / f"{aoi.name}.html"
+    tmp_path = html_path.with_suffix(".html.tmp")
+    tmp_path.write_text(html)
+    tmp_path.replace(html_path)
+
+    pdf_path = output_dir / f"{aoi.name}.pdf"
+    tmp_path = pdf_path.with_suffix(".pdf.tmp")
+    with create_report_pdf_file(html) as pdf_file, tmp_path.open("wb") as f:
+        shutil.copyfileobj(pdf_file, f)
+    tmp_path.replace(pdf_path)
+    return time.perf_counter() - start
+
+
+def iter_builds(
+    aois: list[AOI], output_dir: Path, workers: int
+) -> Iterator[tuple[AOI, Optional[float], Optional[str]]]:
+    """Build the reports of aois, yielding (aoi, seconds, error) in completion order"""
+    if workers <= 0:
+        _warm_up()
+        for aoi in aois:
+            try:
+                yield aoi, build_aoi(aoi, output_dir), None
+            except Exception as e:
+                yield aoi, None, f"{type(e).__name__}: {e}"
+        return
+
+    # the batch is parallel over the areas, so the workers render their
+    # figures and PDFs themselves rather than starting pools of their own
+    os.environ.setdefault("PLOT_WORKERS", "0")
+    os.environ.setdefault("PDF_SECTION_WORKERS", "0")
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(aois)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_up,
+    ) as pool:
+        futures = {pool.submit(build_aoi, aoi, output_dir): aoi for aoi in aois}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, f"{type(e).__name__}: {e}"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the reports of the areas of interest in a GeoJSON file")
+    parser.add_argument("aois", type=Path, help="GeoJSON FeatureCollection, Feature or geometry, or a file with one per line")
+    parser.add_argument("--output-dir", type=Path, default=Path("reports"), help="directory the reports and progress are written to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 0 builds the reports in this process")
+    parser.add_argument("--name-property", default="name", help="feature property holding the name of an area")
+    args = parser.parse_args(argv)
+
+    aois = read_aois(args.aois, args.name_property)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    progress = load_progress(args.output_dir)
+    pending = [aoi for aoi in aois if not is_built(aoi, progress.get(aoi.name), args.output_dir)]
+    print(f"{len(aois) - len(pending)} of {len(aois)} reports already built")
+    if not pending:
+        return 0
+
+    failed = 0
+    with (args.output_dir / PROGRESS_FILE).open("a") as progress_file:
+        for i, (aoi, seconds, error) in enumerate(iter_builds(pending, args.output_dir, args.workers), 1):
+            record = {
+                "name": aoi.name,
+                "polygon_key": polygon_key(aoi.polygon),
+                "status": "failed" if error else "done",
+                "seconds": seconds,
+                "error": error,
+                "finished": time.time(),
+            }
+            progress_file.write(json.dumps(record) + "\n")
+            progress_file.flush()
+            if error:
+                failed += 1
+                print(f"[{i}/{len(pending)}] {aoi.name} failed: {error}")
+            else:
+                print(f"[{i}/{len(pending)}] {aoi.name} built in {seconds:.1f}s")
+
+    print(f"built {len(pending) - failed} reports, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,18 +8,31 @@ from .popgpd import get_world_pop_content
 #from .subtreat import get_sub_threat_content
 
 
-def get_dataset_content(dataset_id: str, xarr: xr.Dataset) -> Optional[DatasetContent]:
+def get_dataset_content(
+    dataset_id: str, xarr: xr.Dataset, scatter_xarr: Optional[xr.Dataset] = None
+) -> Optional[DatasetContent]:
+    """Get the content of a dataset
+
+    Args:
+        dataset_id (str): id of the dataset
+        xarr (xr.Dataset): full resolution slice of the dataset
+        scatter_xarr (xr.Dataset, optional): slice of a pre-aggregated level
+            of the dataset, drawn in the scatter layers instead of xarr
+
+    Returns:
+        Optional[DatasetContent]: content, None for unsupported datasets
+    """
     match dataset_id:
         # case "esl_gwl":
         #     return get_esl_content(xarr)
         case "sed_class":
             return get_sedclass_content(xarr)
         case "shore_mon":
-            return get_shoremon_content(xarr)
+            return get_shoremon_content(xarr, scatter_xarr)
         case "shore_mon_fut":
             return get_shoremon_fut_content(xarr)
         case "world_pop":
-            return get_world_pop_content(xarr)
+            return get_world_pop_content(xarr, scatter_xarr)
         # case "sub_threat":
         #     return None
         case _:
@@ -0,0 +1,210 @@
+"""Web map tiles for the report basemaps, cached in local MBTiles files
+
+Tiles are read from ``{BASEMAP_CACHE_DIR}/{provider}.mbtiles`` and fetched from
+the provider on a miss, unless BASEMAP_OFFLINE is set, in which case missing
+tiles are left transparent. Common regions can be fetched up front with
+
+    python -m datasets.basemap --provider CartoDB.Voyager --bbox 2 50 8 55 --zoom 0-10
+"""
+import argparse
+import math
+import os
+import sqlite3
+import tempfile
+import urllib.request
+from contextlib import closing
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xyzservices.providers as xyz
+from matplotlib.axes import Axes
+from PIL import Image
+
+BASEMAP_CACHE_DIR = Path(
+    os.getenv("BASEMAP_CACHE_DIR", Path(tempfile.gettempdir()) / "gca-basemap-tiles")
+)
+BASEMAP_OFFLINE = os.getenv("BASEMAP_OFFLINE", "").lower() in ("1", "true", "yes")
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+USER_AGENT = "global-coastal-atlas-report"
+
+
+class TileCache:
+    """Tiles of a single provider in an MBTiles (SQLite) file"""
+
+    def __init__(self, provider_name: str, cache_dir: Path = BASEMAP_CACHE_DIR, offline: bool = BASEMAP_OFFLINE):
+        self.provider = xyz.query_name(provider_name)
+        self.offline = offline
+        self.path = Path(cache_dir) / f"{provider_name}.mbtiles"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, "
+                "tile_row INTEGER, tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row))"
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+                [("name", provider_name), ("format", "png")],
+            )
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """Get tile z/x/y (XYZ scheme), fetching it unless offline"""
+        # MBTiles rows use the TMS scheme, counting from the south
+        tms_y = 2**z - 1 - y
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, tms_y),
+            ).fetchone()
+        if row is not None:
+            return row[0]
+        if self.offline:
+            return None
+
+        tile = self._fetch(z, x, y)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                (z, x, tms_y, tile),
+            )
+        return tile
+
+    @property
+    def max_zoom(self) -> int:
+        return int(self.provider.get("max_zoom", 19))
+
+    def _fetch(self, z: int, x: int, y: int) -> bytes:
+        url = self.provider.build_url(x=x, y=y, z=z)
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.read()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+
+_tile_caches: dict[str, TileCache] = {}
+
+
+def get_tile_cache(provider_name: str) -> TileCache:
+    if provider_name not in _tile_caches:
+        _tile_caches[provider_name] = TileCache(provider_name)
+    return _tile_caches[provider_name]
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> tuple[float, float]:
+    """Fractional XYZ tile coordinates of lon/lat at zoom z"""
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    n = 2**z
+    x = (lon + 180) / 360 * n
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n
+    return x, y
+
+
+def tile_to_lonlat(x: float, y: float, z: int) -> tuple[float, float]:
+    """lon/lat of the north-west corner of fractional tile x/y at zoom z"""
+    n = 2**z
+    lon = x / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    return lon, lat
+
+
+def get_zoom(xlim: tuple[float, float], width_px: float, max_zoom: int) -> int:
+    """Lowest zoom level with at least one tile pixel per output pixel"""
+    span = max(xlim[1] - xlim[0], 1e-6)
+    zoom = math.ceil(math.log2(360 * width_px / (TILE_SIZE * span)))
+    return int(np.clip(zoom, 0, max_zoom))
+
+
+def get_basemap_image(
+    provider_name: str, xlim: tuple[float, float], ylim: tuple[float, float], zoom: int
+) -> tuple[np.ndarray, tuple[float, float, float, float]]:
+    """Mosaic the tiles covering xlim/ylim and resample them to lon/lat
+
+    Returns:
+        tuple[np.ndarray, tuple]: RGBA image and its (west, east, south, north) extent
+    """
+    cache = get_tile_cache(provider_name)
+    n = 2**zoom
+    x_min, y_min = lonlat_to_tile(xlim[0], ylim[1], zoom)
+    x_max, y_max = lonlat_to_tile(xlim[1], ylim[0], zoom)
+    x_tiles = range(max(int(x_min), 0), min(int(x_max), n - 1) + 1)
+    y_tiles = range(max(int(y_min), 0), min(int(y_max), n - 1) + 1)
+
+    mosaic = np.zeros((len(y_tiles) * TILE_SIZE, len(x_tiles) * TILE_SIZE, 4), dtype=np.uint8)
+    for row, y in enumerate(y_tiles):
+        for col, x in enumerate(x_tiles):
+            tile = cache.get_tile(zoom, x, y)
+            if tile is None:
+                continue
+            mosaic[row * TILE_SIZE:(row + 1) * TILE_SIZE, col * TILE_SIZE:(col + 1) * TILE_SIZE] = np.asarray(
+                Image.open(BytesIO(tile)).convert("RGBA")
+            )
+
+    west, north = tile_to_lonlat(x_tiles.start, y_tiles.start, zoom)
+    east, south = tile_to_lonlat(x_tiles.stop, y_tiles.stop, zoom)
+
+    # Longitude is linear in web mercator, latitude is not: pick for every
+    # output row, evenly spaced in latitude, the nearest web mercator row
+    lats = np.linspace(north, south, mosaic.shape[0], endpoint=False)
+    lats += (south - north) / mosaic.shape[0] / 2
+    _, tile_rows = lonlat_to_tile(0, lats, zoom)
+    rows = np.clip(((tile_rows - y_tiles.start) * TILE_SIZE).astype(int), 0, mosaic.shape[0] - 1)
+
+    return mosaic[rows], (west, east, south, north)
+
+
+def get_width_px(ax: Axes) -> float:
+    """Width of ax in pixels as it will be drawn
+
+    Inset axes are positioned by their locator and fixed aspect axes are
+    shrunk only when the figure is drawn, so apply both first.
+    """
+    locator = ax.get_axes_locator()
+    ax.apply_aspect(locator(ax, None) if locator is not None else None)
+    return ax.get_window_extent().width
+
+
+def add_basemap(ax: Axes, provider_name: str):
+    """Draw the basemap tiles of provider_name under the data of a lon/lat axes"""
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    width_px = get_width_px(ax)
+    zoom = get_zoom(xlim, width_px, get_tile_cache(provider_name).max_zoom)
+
+    image, extent = get_basemap_image(provider_name, xlim, ylim, zoom)
+    ax.imshow(image, extent=extent, origin="upper", zorder=0, interpolation="bilinear")
+    # imshow rescales the axes to the image, restore the requested extent
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+
+
+def prefetch(provider_name: str, bbox: tuple[float, float, float, float], zooms: range):
+    """Fetch all tiles of provider_name within bbox (west, south, east, north) at zooms"""
+    cache = get_tile_cache(provider_name)
+    for zoom in zooms:
+        n = 2**zoom
+        x_min, y_min = lonlat_to_tile(bbox[0], bbox[3], zoom)
+        x_max, y_max = lonlat_to_tile(bbox[2], bbox[1], zoom)
+        count = 0
+        for x in range(max(int(x_min), 0), min(int(x_max), n - 1) + 1):
+            for y in range(max(int(y_min), 0), min(int(y_max), n - 1) + 1):
+                cache.get_tile(zoom, x, y)
+                count += 1
+        print(f"{provider_name}: cached {count} tiles at zoom {zoom}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch basemap tiles into the local tile cache")
+    parser.add_argument("--provider", action="append", required=True, help="xyzservices provider name, e.g. CartoDB.Voyager")
+    parser.add_argument("--bbox", nargs=4, type=float, required=True, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    parser.add_argument("--zoom", default="0-10", help="zoom level or range, e.g. 8 or 0-10")
+    args = parser.parse_args()
+
+    zoom_min, _, zoom_max = args.zoom.partition("-")
+    zooms = range(int(zoom_min), int(zoom_max or zoom_min) + 1)
+    for provider_name in args.provider:
+        prefetch(provider_name, tuple(args.bbox), zooms)
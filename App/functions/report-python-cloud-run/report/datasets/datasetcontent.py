@@ -7,5 +7,7 @@ class DatasetContent:
     dataset_id: str
     title: str
     text: str
-    image_base64: Optional[str] = None
+    image_src: Optional[str] = None
     image_svg: Optional[str] = None
+    # LLM prompt for the text, filled in by the text generation stage
+    prompt: Optional[str] = None
@@ -0,0 +1,175 @@
+"""Encoding of the report figures
+
+Figures are saved at ``FIGURE_DPI`` for the width of the slot they fill in
+section.html.jinja, rather than at the size they were drawn at. Categorical
+maps are quantised to a small palette and basemap imagery is saved as JPEG or
+WebP; an encoding is only kept when it is smaller than the lossless PNG.
+
+The encoded figure is returned as an image source for the template: a data
+URI, or with ``FIGURE_ASSET_DIR`` set, the URL of a file in the asset store.
+The asset store is bounded by ``FIGURE_ASSET_MAX_BYTES`` and evicts the least
+recently used figures; cached html whose figures were evicted is not served.
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from matplotlib.figure import Figure
+from PIL import Image
+
+from utils.metrics import record_figure, stage
+
+# resolution of the figures in the report, in pixels per inch of the page
+FIGURE_DPI = float(os.getenv("FIGURE_DPI", "200"))
+# jpeg, webp or png, format of figures with basemap imagery
+FIGURE_PHOTO_FORMAT = os.getenv("FIGURE_PHOTO_FORMAT", "jpeg").lower()
+FIGURE_PHOTO_QUALITY = int(os.getenv("FIGURE_PHOTO_QUALITY", "85"))
+# maximum number of colours of categorical maps
+FIGURE_PALETTE_COLORS = int(os.getenv("FIGURE_PALETTE_COLORS", "64"))
+# directory the figures are stored in, empty inlines them in the html
+FIGURE_ASSET_DIR = os.getenv("FIGURE_ASSET_DIR", "")
+# URL the asset store is served under
+FIGURE_ASSET_URL = os.getenv("FIGURE_ASSET_URL", "/assets/")
+FIGURE_ASSET_MAX_BYTES = int(os.getenv("FIGURE_ASSET_MAX_BYTES", str(2 * 2**30)))
+# also save every figure as before the slot encoding, to measure the bytes saved
+FIGURE_MEASURE_SAVINGS = os.getenv("FIGURE_MEASURE_SAVINGS", "").lower() in ("1", "true", "yes")
+
+# width of the image slots of section.html.jinja in inches: the A4 page less
+# the 14mm padding of the sections, and half of that in the two column layouts
+SLOT_WIDTHS = {"full": 182 / 25.4, "half": 91 / 25.4}
+KINDS = ("plot", "categorical", "photo")
+
+EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+ASSET_URL_PATTERN = re.compile(re.escape(FIGURE_ASSET_URL) + r"([0-9a-f]{32}\.(?:png|jpg|webp))")
+
+
+def encode_figure(fig: Figure, slot: str = "full", kind: str = "plot") -> str:
+    """Encode a matplotlib figure for the report
+
+    Args:
+        fig (Figure): figure to encode
+        slot (str, optional): "full" or "half" width slot the figure is shown in
+        kind (str, optional): "plot" is kept as lossless PNG, "categorical" is
+            quantised to a palette and "photo" is saved in FIGURE_PHOTO_FORMAT
+
+    Returns:
+        str: image source of the figure, a data URI or asset store URL
+    """
+    with stage("encode"):
+        dpi = FIGURE_DPI * SLOT_WIDTHS[slot] / fig.get_figwidth()
+        png = BytesIO()
+        fig.savefig(png, transparent=True, format="png", bbox_inches="tight", dpi=dpi)
+        png_bytes = png.getvalue()
+        image_format, data = compress_image(png_bytes, kind)
+
+        saved = 0
+        if FIGURE_MEASURE_SAVINGS:
+            # figures used to be saved as lossless PNG at the dpi they were drawn at
+            baseline = BytesIO()
+            fig.savefig(baseline, transparent=True, format="png", bbox_inches="tight")
+            saved = baseline.tell() - len(data)
+        record_figure(len(data), saved)
+        return image_src(data, image_format)
+
+
+def compress_image(png: bytes, kind: str) -> tuple[str, bytes]:
+    """Compress a PNG for its kind of figure
+
+    Returns:
+        tuple[str, bytes]: format and data of the smallest encoding
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown figure kind {kind}, expected one of {KINDS}")
+
+    image_format, data = "png", png
+    if kind == "categorical":
+        image = Image.open(BytesIO(png)).convert("RGBA")
+        image = image.quantize(colors=FIGURE_PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+        out = BytesIO()
+        image.save(out, format="png", optimize=True)
+        image_format, data = "png", out.getvalue()
+    elif kind == "photo" and FIGURE_PHOTO_FORMAT in ("jpeg", "webp"):
+        image = Image.open(BytesIO(png)).convert("RGBA")
+        if FIGURE_PHOTO_FORMAT == "jpeg":
+            # jpeg has no transparency, the report pages are white
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        out = BytesIO()
+        image.save(out, format=FIGURE_PHOTO_FORMAT, quality=FIGURE_PHOTO_QUALITY)
+        image_format, data = FIGURE_PHOTO_FORMAT, out.getvalue()
+
+    if len(data) >= len(png):
+        return "png", png
+    return image_format, data
+
+
+def image_src(data: bytes, image_format: str) -> str:
+    """Image source of encoded figure data, stored in the asset store when
+    it is enabled"""
+    if not FIGURE_ASSET_DIR:
+        return f"data:image/{image_format};base64,{base64.b64encode(data).decode('ascii')}"
+
+    # content addressed, so an asset never changes once written
+    name = f"{hashlib.sha256(data).hexdigest()[:32]}.{EXTENSIONS[image_format]}"
+    path = Path(FIGURE_ASSET_DIR) / name
+    if _touch(path):
+        return FIGURE_ASSET_URL + name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+    evict_assets()
+    return FIGURE_ASSET_URL + name
+
+
+def touch_assets(html: str) -> bool:
+    """Mark the figures html references in the asset store as recently used
+
+    Returns:
+        bool: False when a figure has been evicted, so html can't be served
+    """
+    if not FIGURE_ASSET_DIR:
+        return True
+    return all(_touch(Path(FIGURE_ASSET_DIR) / name) for name in ASSET_URL_PATTERN.findall(html))
+
+
+def _touch(path: Path) -> bool:
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def evict_assets():
+    """Remove the least recently used figures until the asset store fits in
+    FIGURE_ASSET_MAX_BYTES"""
+    entries = []
+    for path in Path(FIGURE_ASSET_DIR).iterdir():
+        if path.suffix == ".tmp":
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= FIGURE_ASSET_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def resolve_asset_urls(html: str) -> str:
+    """Replace the asset store URLs in html by file URLs, for rendering it
+    without the web server"""
+    if not FIGURE_ASSET_DIR:
+        return html
+    return ASSET_URL_PATTERN.sub(lambda match: (Path(FIGURE_ASSET_DIR) / match.group(1)).resolve().as_uri(), html)
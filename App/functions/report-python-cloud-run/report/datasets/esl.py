@@ -1,6 +1,7 @@
 # Packages for loading data
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import xarray as xr
 # Packages for plotting
 from resilientplotterclass import rpc
@@ -10,15 +11,14 @@ matplotlib.use("Agg")
 plt.rcParams["svg.fonttype"] = "none"
 import numpy as np
 
-from .utils import plot_to_base64
+from .encoding import encode_figure
 from .datasetcontent import DatasetContent
+from .rendering import render_plot
+from .world import plot_world_boundary
 from utils.gentext import describe_data
 
 # from matplotlib import colors ##TODO
 
-world = gpd.read_file(
-    Path(__file__).parent.parent.parent / "data" / "world_administrative.zip"
-)
 
 def get_esl_content(xarr: xr.Dataset) -> list[DatasetContent]:
     dataset_contents_list = []
@@ -35,12 +35,12 @@ def get_esl26_content(xarr: xr.Dataset) -> DatasetContent:
     title = "Extreme Sea Level"
     text = "Here we generate some content based on the ESL dataset"
 
-    image_base64 = create_esl_plot(xarr, 'RCP26')
+    image_src = render_plot(create_esl_plot, xarr, 'RCP26')
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
     )
 
 def get_esl45_content(xarr: xr.Dataset) -> DatasetContent:
@@ -49,12 +49,12 @@ def get_esl45_content(xarr: xr.Dataset) -> DatasetContent:
     title = "Extreme Sea Level"
     text = "Here we generate some content based on the ESL dataset"
 
-    image_base64 = create_esl_plot(xarr, 'RCP45')
+    image_src = render_plot(create_esl_plot, xarr, 'RCP45')
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
     )
 
 def get_esl85_content(xarr: xr.Dataset) -> DatasetContent:
@@ -63,12 +63,12 @@ def get_esl85_content(xarr: xr.Dataset) -> DatasetContent:
     title = "Extreme Sea Level"
     text = "Here we generate some content based on the ESL dataset"
 
-    image_base64 = create_esl_plot(xarr, 'RCP85')
+    image_src = render_plot(create_esl_plot, xarr, 'RCP85')
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
     )
 
 
@@ -97,11 +97,10 @@ def create_esl_plot(xarr, scenario):
     xlim = [lonmin - 0.1, lonmax + 0.1]
     ylim = [latmin - 0.1, latmax + 0.1]
 
-    fig, ax = plt.subplots(1, 1, figsize=(10,10))
+    fig = Figure(figsize=(10,10))
+    ax = fig.subplots(1, 1)
 
-    base = world.boundary.plot(
-        ax=ax, edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-    )
+    base = plot_world_boundary(ax, xlim, ylim)
 
     rpc.scatter(xarr.sel(ensemble=5), data_type='data',
                 ax=ax,
@@ -143,4 +142,4 @@ def create_esl_plot(xarr, scenario):
 
     fig.tight_layout()
     
-    return plot_to_base64(fig)
+    return encode_figure(fig, slot="half")
@@ -1,38 +1,41 @@
 # Packages for loading data
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import xarray as xr
 # Packages for plotting
 from resilientplotterclass import rpc
 from pathlib import Path
+from typing import Optional
 import matplotlib
 matplotlib.use("Agg")
 plt.rcParams["svg.fonttype"] = "none"
 import numpy as np
 from shapely import Polygon  # type: ignore
 
-from .utils import plot_to_base64
+from .encoding import encode_figure
 from .datasetcontent import DatasetContent
+from .rendering import render_plot
+from .basemap import add_basemap
 from utils.gentext import describe_overview
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
-world = gpd.read_file(
-    Path(__file__).parent.parent.parent / "data" / "world_administrative.zip"
-)
 
-def get_overview(polygon: Polygon, dataset_contents: DatasetContent) -> DatasetContent:
-    """Get overview"""
+def get_overview(polygon: Polygon, dataset_contents: DatasetContent, image_src: Optional[str] = None, text: Optional[str] = None) -> DatasetContent:
+    """Get overview. The image only depends on the polygon and the text can be
+    generated together with the section texts, so both can be passed in"""
     dataset_id = "overview"
     title = "Overview"
-    text = "Here we generate some content based on all datasets"
-    text = describe_overview(polygon, dataset_contents)
+    if text is None:
+        text = describe_overview(polygon, dataset_contents)
 
-    image_base64 = create_overview_img(polygon)
+    if image_src is None:
+        image_src = render_plot(create_overview_img, polygon)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
     )
 
 
@@ -51,21 +54,22 @@ def create_overview_img(polygon: Polygon):
     gdf_aoi= gpd.GeoDataFrame({'Name': ['Custom'], 'geometry': [polygon]}, crs='EPSG:4326')
     center = gdf_aoi.centroid
 
-    fig, ax = plt.subplots(1, 2, figsize=(20, 16), width_ratios=[1,1])
+    fig = Figure(figsize=(20, 16))
+    ax = fig.subplots(1, 2, width_ratios=[1,1])
 
     xlims, ylims = cal_xylims(gdf_aoi, 2.5)
 
     ax[0].scatter(center.x[0], center.y[0],color='r', marker='o')
     ax[0].set_xlim(xlims)
     ax[0].set_ylim(ylims)
-    rpc.basemap(crs='EPSG:4326', map_type='satellite', ax=ax[0], source='CartoDB.Voyager')
+    add_basemap(ax[0], 'CartoDB.Voyager')
 
     worldax = inset_axes(ax[0], width=2.5, height=2, loc='upper left')
     worldax.scatter(center.x[0], center.y[0],color='r', marker='o')
     xlims, ylims = cal_xylims(gdf_aoi, 18)
     worldax.set_xlim(xlims)
     worldax.set_ylim(ylims)
-    rpc.basemap(crs=gdf_aoi.crs, ax=worldax,  map_type='satellite', source='CartoDB.Positron')
+    add_basemap(worldax, 'CartoDB.Positron')
     worldax.set_xticklabels([])
     worldax.set_yticklabels([])
     worldax.set_xlabel(None)
@@ -77,6 +81,6 @@ def create_overview_img(polygon: Polygon):
     rpc.geometries(gdf_aoi, ax=ax[1], facecolor='none', edgecolor='white', linewidth=1)
     ax[1].set_xlim(xlims)
     ax[1].set_ylim(ylims)
-    rpc.basemap(crs=gdf_aoi.crs, map_type='satellite', ax=ax[1])
+    add_basemap(ax[1], 'Esri.WorldImagery')
     
-    return plot_to_base64(fig)
+    return encode_figure(fig, kind="photo")
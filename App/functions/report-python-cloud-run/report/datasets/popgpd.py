@@ -1,48 +1,57 @@
 # Packages for loading data
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import xarray as xr
 # Packages for plotting
 from resilientplotterclass import rpc
 from pathlib import Path
+from typing import Optional
 import matplotlib
 matplotlib.use("Agg")
 plt.rcParams["svg.fonttype"] = "none"
 import numpy as np
 
-from .utils import plot_to_base64
+from .encoding import encode_figure
 from .datasetcontent import DatasetContent
-from utils.gentext import describe_data
+from .rendering import render_plot
+from .world import plot_world_boundary
+from utils.gentext import make_prompt
 
-world = gpd.read_file(
-        Path(__file__).parent.parent.parent / "data" / "world_administrative.zip"
-    )
 
-def get_world_pop_content(xarr: xr.Dataset) -> DatasetContent:
-    """Get content for the dataset"""
+def get_world_pop_content(xarr: xr.Dataset, scatter_xarr: Optional[xr.Dataset] = None) -> DatasetContent:
+    """Get content for the dataset, drawing the stations of scatter_xarr when given"""
     dataset_id = "world_pop"
     title = "The Population"
     text = "Here we generate some content based on the dataset"
-    text = describe_data(xarr, dataset_id)
+    prompt = make_prompt(xarr, dataset_id)
 
-    image_base64 = create_world_pop_plot(xarr)
+    if scatter_xarr is None:
+        image_src = render_plot(create_world_pop_plot, xarr)
+    else:
+        max_pop = float(xarr['pop_tot'].max())
+        image_src = render_plot(create_world_pop_plot, scatter_xarr, max_pop)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
+        prompt=prompt,
     )
 
-def create_world_pop_plot(xarr):
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
+def create_world_pop_plot(xarr, max_pop=None):
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots(1, 1)
 
-    base = world.boundary.plot(
-        ax=ax, edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-    )
+    sizes = xarr['pop_tot'].values / 100
+    if max_pop is not None and xarr['pop_tot'].max() > 0:
+        # cells of an aggregated level sum their stations, scale the markers
+        # to the largest station of the full resolution slice
+        sizes = sizes * max_pop / float(xarr['pop_tot'].max())
 
     p = rpc.scatter(xarr, ax=ax, data_type='data',
                     x='lon', y='lat', 
-                    s=xarr['pop_tot'].values/100, hue='pop_tot',
+                    s=sizes, hue='pop_tot',
                     edgecolor='none', cmap='RdYlGn', 
                     add_colorbar=True, cbar_kwargs={'label': 'Population'}
                     )
@@ -55,6 +64,8 @@ def create_world_pop_plot(xarr):
     xlim = [lonmin - 0.1, lonmax + 0.1]
     ylim = [latmin - 0.1, latmax + 0.1]
 
+    base = plot_world_boundary(ax, xlim, ylim)
+
     ax.set(
         xlim=xlim,
         ylim=ylim,
@@ -65,4 +76,4 @@ def create_world_pop_plot(xarr):
 
     fig.tight_layout()
 
-    return plot_to_base64(fig)
\ No newline at end of file
+    return encode_figure(fig, slot="half")
\ No newline at end of file
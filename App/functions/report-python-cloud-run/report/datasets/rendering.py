@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+import xarray as xr
+
+from utils.concurrency import discard_process_pool
+from utils.metrics import record, stage, trace_report
+
+# 0 renders figures on the calling thread
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", str(os.cpu_count() or 1)))
+# seconds a figure may take in the rendering pool
+PLOT_TIMEOUT = float(os.getenv("PLOT_TIMEOUT", "120"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _warm_up():
+    """Initialise a rendering worker: import the plotting stack and load the
+    font cache and colormaps before the first figure is requested"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import font_manager
+    import matplotlib.pyplot as plt
+
+    font_manager.findfont(matplotlib.rcParams["font.family"][0])
+    matplotlib.colormaps["RdYlGn"]
+    matplotlib.colormaps["RdYlGn_r"]
+
+    # importing the dataset modules imports resilientplotterclass and geopandas
+    from . import esl, overview, popgpd, shoremon, slr  # noqa: F401
+    from .world import get_world_boundary
+
+    get_world_boundary()
+    plt.close("all")
+
+
+def _render(plot_func: Callable[..., str], args: tuple) -> tuple[str, dict]:
+    """Render a figure, returning it with the stage statistics of the worker"""
+    try:
+        with trace_report() as trace:
+            result = plot_func(*args)
+        return result, trace.to_dict()
+    finally:
+        # each worker renders one figure at a time, so it is safe to drop any
+        # figure a plotting library registered with pyplot
+        import matplotlib.pyplot as plt
+
+        plt.close("all")
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Get the shared rendering pool, None when rendering in-process"""
+    global _pool
+    if PLOT_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PLOT_WORKERS,
+                # forking a threaded web server is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+            )
+        return _pool
+
+
+def reset_pool(pool: ProcessPoolExecutor):
+    """Discard a broken or hung rendering pool, the next figure starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    discard_process_pool(pool)
+
+
+def render_plot(plot_func: Callable[..., str], *args: Any) -> str:
+    """Render a figure in the rendering pool
+
+    Args:
+        plot_func (Callable): module level create_*_plot function returning the
+            encoded figure
+        *args: arguments of plot_func; xarray datasets are loaded before they
+            are sent to the worker so it doesn't have to fetch them again
+
+    Returns:
+        str: encoded figure as returned by plot_func
+
+    Raises:
+        TimeoutError: the figure took longer than PLOT_TIMEOUT in the pool
+    """
+    with stage("plot"):
+        pool = get_pool()
+        if pool is None:
+            return plot_func(*args)
+
+        args = tuple(
+            arg.compute() if isinstance(arg, (xr.Dataset, xr.DataArray)) else arg
+            for arg in args
+        )
+        try:
+            result, stages = pool.submit(_render, plot_func, args).result(timeout=PLOT_TIMEOUT)
+        except BrokenProcessPool as e:
+            # a worker died, e.g. out of memory, which broke the whole pool
+            print(f"rendering pool is broken, rendering {plot_func.__name__} in-process: {e}")
+            reset_pool(pool)
+            return plot_func(*args)
+        except TimeoutError:
+            # don't let the hung worker hold a slot of the pool
+            reset_pool(pool)
+            raise TimeoutError(f"{plot_func.__name__} did not finish within {PLOT_TIMEOUT}s")
+        for name, values in stages.items():
+            record(name, **values)
+        return result
@@ -1,52 +1,62 @@
 # Packages for loading data
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import xarray as xr
 # Packages for plotting
 from resilientplotterclass import rpc
 from pathlib import Path
+from typing import Optional
 import matplotlib
 matplotlib.use("Agg")
 plt.rcParams["svg.fonttype"] = "none"
 import numpy as np
 
-from .utils import plot_to_base64
+from .encoding import encode_figure
 from .datasetcontent import DatasetContent
-from utils.gentext import describe_data
+from .rendering import render_plot
+from .world import plot_world_boundary
+from utils.gentext import make_prompt
+
+# shoreline change rate classes in m/yr, from extreme erosion to extreme accretion
+CHANGE_BINS = [-np.inf, -5, -3, -1, -0.5, 0.5 , 1, 3, 5, np.inf]
 
-world = gpd.read_file(
-        Path(__file__).parent.parent.parent / "data" / "world_administrative.zip"
-    )
 
 def get_sedclass_content(xarr: xr.Dataset) -> DatasetContent:
     """Get content for the dataset"""
     dataset_id = "sediment_class"
     title = "Coastal Types"
     text = "Here we generate some content based on the the dataset"
-    text = describe_data(xarr, dataset_id)
+    prompt = make_prompt(xarr, dataset_id)
 
-    image_base64 = create_sedclass_plot(xarr)
+    image_src = render_plot(create_sedclass_plot, xarr)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
+        prompt=prompt,
     )
 
 
-def get_shoremon_content(xarr: xr.Dataset) -> DatasetContent:
-    """Get content for the dataset"""
+def get_shoremon_content(xarr: xr.Dataset, scatter_xarr: Optional[xr.Dataset] = None) -> DatasetContent:
+    """Get content for the dataset, drawing the transects of scatter_xarr when given"""
     dataset_id = "shoreline_change"
     title = "Historical Shoreline Change (1984-2021)"
     text = "Here we generate some content based on the the dataset"
-    text = describe_data(xarr, dataset_id)
+    prompt = make_prompt(xarr, dataset_id)
 
-    image_base64 = create_shoremon_plot(xarr)
+    # the classes count transects, not the cells of an aggregated level
+    class_counts = get_change_classes(xarr)
+    if scatter_xarr is None:
+        scatter_xarr = xarr
+    image_src = render_plot(create_shoremon_plot, scatter_xarr, class_counts)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
+        prompt=prompt,
     )
 
 def get_shoremon_fut_content(xarr: xr.Dataset) -> list[DatasetContent]:
@@ -63,14 +73,15 @@ def get_shoremon_fut2050_content(xarr: xr.Dataset) -> DatasetContent:
     dataset_id = "future_shoreline_change_2050"
     title = "Future Shoreline Projections in 2050"
     text = "Here we generate some content based on the the dataset"
-    text = describe_data(xarr, dataset_id)
+    prompt = make_prompt(xarr, dataset_id)
 
-    image_base64 = create_shoremon_fut_plot(xarr, 2050)
+    image_src = render_plot(create_shoremon_fut_plot, xarr, 2050)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
+        prompt=prompt,
     )
 
 def get_shoremon_fut2100_content(xarr: xr.Dataset) -> DatasetContent:
@@ -78,14 +89,15 @@ def get_shoremon_fut2100_content(xarr: xr.Dataset) -> DatasetContent:
     dataset_id = "future_shoreline_change_2100"
     title = "Future Shoreline Projections in 2100"
     text = "Here we generate some content based on the the dataset"
-    text = describe_data(xarr, dataset_id)
+    prompt = make_prompt(xarr, dataset_id)
 
-    image_base64 = create_shoremon_fut_plot(xarr, 2100)
+    image_src = render_plot(create_shoremon_fut_plot, xarr, 2100)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
+        prompt=prompt,
     )
 
 # def get_shoremon_fut_content(xarr: xr.Dataset) -> list[DatasetContent]:
@@ -103,12 +115,12 @@ def get_shoremon_fut2100_content(xarr: xr.Dataset) -> DatasetContent:
 #     text = "Here we generate some content based on the the dataset" ##TODO: to be filled in by LLM
 #     text = describe_data(xarr, dataset_id)
 
-#     image_base64 = create_shoremon_fut_plot(xarr, 'RCP45')
+#     image_src = create_shoremon_fut_plot(xarr, 'RCP45')
 #     return DatasetContent(
 #         dataset_id=dataset_id,
 #         title=title,
 #         text=text,
-#         image_base64=image_base64,
+#         image_src=image_src,
 #     )
 
 # def get_shoremon_fut85_content(xarr: xr.Dataset) -> DatasetContent:
@@ -118,12 +130,12 @@ def get_shoremon_fut2100_content(xarr: xr.Dataset) -> DatasetContent:
 #     text = "Here we generate some content based on the the dataset" ##TODO: to be filled in by LLM
 #     text = describe_data(xarr, dataset_id)
 
-#     image_base64 = create_shoremon_fut_plot(xarr, 'RCP85')
+#     image_src = create_shoremon_fut_plot(xarr, 'RCP85')
 #     return DatasetContent(
 #         dataset_id=dataset_id,
 #         title=title,
 #         text=text,
-#         image_base64=image_base64,
+#         image_src=image_src,
 #     )
 
 
@@ -152,11 +164,8 @@ def create_sedclass_plot(xarr):
         portion.append(port)
 
     # Plot the data
-    fig, ax = plt.subplots(1, 2, figsize=(10, 5), width_ratios=[1,1])
-    
-    base = world.boundary.plot(
-        ax=ax[0], edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-    )
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots(1, 2, width_ratios=[1,1])
 
     aspect = len(existing_class) / 0.8
     p = rpc.scatter(xarr, ax=ax[0], 
@@ -166,7 +175,7 @@ def create_sedclass_plot(xarr):
                     add_colorbar=False
                     )
     
-    cbar = plt.colorbar(cb, ax=ax[0], 
+    cbar = fig.colorbar(cb, ax=ax[0], 
                         **{'label': 'Sediment classes', 'pad': 0.01, 
                            'fraction': 0.05,'aspect':aspect})
     cbar.set_ticks(ticks=np.arange(0.5, len(existing_color), 1), labels=existing_class)
@@ -181,6 +190,8 @@ def create_sedclass_plot(xarr):
     xlim = [lonmin - 0.1, lonmax + 0.1]
     ylim = [latmin - 0.1, latmax + 0.1]
 
+    base = plot_world_boundary(ax[0], xlim, ylim)
+
     ax[0].set(
         xlim=xlim,
         ylim=ylim,
@@ -192,10 +203,15 @@ def create_sedclass_plot(xarr):
 
     fig.tight_layout()
     
-    return plot_to_base64(fig)
+    return encode_figure(fig, kind="categorical")
 
 
-def create_shoremon_plot(xarr):
+def get_change_classes(xarr: xr.Dataset) -> np.ndarray:
+    """Number of transects per shoreline change rate class of CHANGE_BINS"""
+    return np.histogram(xarr['changerate'].values, bins=CHANGE_BINS)[0]
+
+
+def create_shoremon_plot(xarr, class_counts=None):
 
     lonmin = min(xarr.lon.values)
     lonmax = max(xarr.lon.values)
@@ -208,14 +224,12 @@ def create_shoremon_plot(xarr):
     # Get pie chart data
     labels = ['Extreme\nerosion', 'Severe\nerosion', 'Intense\nerosion', 'Erosion', 'Stable', 'Accretion', 'Intense\naccretion', 'Severe\naccretion', 'Extreme\naccretion']
     colors = [matplotlib.cm.RdYlGn(i) for i in np.linspace(0.05, 0.95, len(labels))]
-    bins = [-np.inf, -5, -3, -1, -0.5, 0.5 , 1, 3, 5, np.inf]
-    data = np.histogram(xarr['changerate'].values, bins=bins)[0]
+    data = class_counts if class_counts is not None else get_change_classes(xarr)
     
     # Plot data
-    fig, axs = plt.subplots(1, 3, figsize=(15, 5), width_ratios=[1.2, 0.8, 0.3])
-    base = world.boundary.plot(
-        ax=axs[0], edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-    )
+    fig = Figure(figsize=(15, 5))
+    axs = fig.subplots(1, 3, width_ratios=[1.2, 0.8, 0.3])
+    base = plot_world_boundary(axs[0], xlim, ylim)
     rpc.scatter(xarr, data_type='data', 
                 ax=axs[0], 
                 x='lon', y='lat', 
@@ -240,7 +254,7 @@ def create_shoremon_plot(xarr):
 
     fig.tight_layout()
 
-    return plot_to_base64(fig)
+    return encode_figure(fig)
 
 
 # def create_shoremon_fut_plot(xarr):
@@ -301,7 +315,8 @@ def create_shoremon_fut_plot(xarr, year):
     yearlist = [2021, 2050, 2100]
     yr = yearlist.index(year) - 1
 
-    fig, ax = plt.subplots(2, 2, figsize=(10, 10), width_ratios=[6,4])
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots(2, 2, width_ratios=[6,4])
                 
     for nn in range(len(scenariolist)):
             match scenariolist[nn]:
@@ -315,10 +330,6 @@ def create_shoremon_fut_plot(xarr, year):
             diff = xarr.diff('time', 1).sel(time=str(yearlist[yr + 1]))
             rate = diff / (yearlist[yr + 1] - yearlist[yr])
 
-            base = world.boundary.plot(
-                    ax=ax[nn, 0], edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-                )
-            
             p = rpc.scatter(rate, 
                             ax=ax[nn, 0], data_type='data',
                             x='lon', y='lat', 
@@ -335,6 +346,8 @@ def create_shoremon_fut_plot(xarr, year):
             xlim = [lonmin - 0.1, lonmax + 0.1]
             ylim = [latmin - 0.1, latmax + 0.1]
 
+            base = plot_world_boundary(ax[nn, 0], xlim, ylim)
+
             ax[nn, 0].set(
                 xlim=xlim,
                 ylim=ylim,
@@ -357,7 +370,7 @@ def create_shoremon_fut_plot(xarr, year):
 
     fig.tight_layout()
 
-    return plot_to_base64(fig)
+    return encode_figure(fig)
 
 # def create_shoremon_fut_plot(xarr, scenario):
 
@@ -372,7 +385,8 @@ def create_shoremon_fut_plot(xarr, year):
 #             var = 'sp_rcp85_p50'
 #             scenarioname = 'RCP8.5'
 
-#     fig, ax = plt.subplots(2, 2, figsize=(10, 10), width_ratios=[6,4])
+#     fig = Figure(figsize=(10, 10))
+#     ax = fig.subplots(2, 2, width_ratios=[6,4])
                 
 #     for yr in range(0,len(yearlist) - 1):
 #             diff = xarr.diff('time', 1).sel(time=str(yearlist[yr + 1]))
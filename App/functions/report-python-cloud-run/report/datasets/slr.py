@@ -1,6 +1,7 @@
 # Packages for loading data
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import xarray as xr
 # Packages for plotting
 from resilientplotterclass import rpc
@@ -10,12 +11,13 @@ matplotlib.use("Agg")
 plt.rcParams["svg.fonttype"] = "none"
 import numpy as np
 from shapely import Polygon  # type: ignore
-import pystac_client
 import rioxarray as rio
 
-from .utils import plot_to_base64
+from .encoding import encode_figure
 from .datasetcontent import DatasetContent
-from utils.gentext import describe_data
+from .rendering import render_plot
+from utils.gentext import make_prompt
+from utils.stac import get_item_asset_href
 
 
 def get_slr_content(polygon: Polygon) -> DatasetContent:
@@ -24,14 +26,15 @@ def get_slr_content(polygon: Polygon) -> DatasetContent:
     dataset_id = "slr"
     title = "Sea Level Rise Projection"
     text = "Here we generate some content based on the dataset"
-    text = describe_data(slps, dataset_id)
+    prompt = make_prompt(slps, dataset_id)
 
-    image_base64 = create_slr_plot(slps)
+    image_src = render_plot(create_slr_plot, slps)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
+        prompt=prompt,
     )
 
 # def get_slr_content(polygon: Polygon) -> list[DatasetContent]:
@@ -50,12 +53,12 @@ def get_slr_content(polygon: Polygon) -> DatasetContent:
 #     text = "Here we generate some content based on the dataset"
 #     text = describe_data(slps, dataset_id)
 
-#     image_base64 = create_slr_plot(slps, 'RCP26')
+#     image_src = create_slr_plot(slps, 'RCP26')
 #     return DatasetContent(
 #         dataset_id=dataset_id,
 #         title=title,
 #         text=text,
-#         image_base64=image_base64,
+#         image_src=image_src,
 #     )
 
 # def get_slr45_content(polygon: Polygon) -> DatasetContent:
@@ -66,12 +69,12 @@ def get_slr_content(polygon: Polygon) -> DatasetContent:
 #     text = "Here we generate some content based on the dataset"
 #     text = describe_data(slps, dataset_id)
 
-#     image_base64 = create_slr_plot(slps, 'RCP45')
+#     image_src = create_slr_plot(slps, 'RCP45')
 #     return DatasetContent(
 #         dataset_id=dataset_id,
 #         title=title,
 #         text=text,
-#         image_base64=image_base64,
+#         image_src=image_src,
 #     )
 
 # def get_slr85_content(polygon: Polygon) -> DatasetContent:
@@ -82,12 +85,12 @@ def get_slr_content(polygon: Polygon) -> DatasetContent:
 #     text = "Here we generate some content based on the dataset"
 #     text = describe_data(slps, dataset_id)
 
-#     image_base64 = create_slr_plot(slps, 'RCP85')
+#     image_src = create_slr_plot(slps, 'RCP85')
 #     return DatasetContent(
 #         dataset_id=dataset_id,
 #         title=title,
 #         text=text,
-#         image_base64=image_base64,
+#         image_src=image_src,
 #     )
 
 
@@ -104,12 +107,6 @@ def get_slps_data(polygon: Polygon) -> dict:
     # Set stac URL
     STAC_url = "https://raw.githubusercontent.com/openearth/coclicodata/main/current/catalog.json"
 
-    # Open the catalog
-    catalog = pystac_client.Client.open(STAC_url)
-
-    # Get the AR6 collection
-    collection = catalog.get_child("slp")
-
     ssps = ['high_end', 'ssp126','ssp245','ssp585']
     msls = ["msl_m"]
     years = ["2031","2041","2051", "2061", "2071", "2081", "2091", "2101","2111","2121","2131","2141","2151"]
@@ -120,11 +117,8 @@ def get_slps_data(polygon: Polygon) -> dict:
     for ssp in ssps:
         for msl in msls:
             for year in years:
-                # Get the item
-                item = collection.get_item(f"{ssp}\{msl}\{year}.tif")
-                
-                # Get href
-                href = item.assets["data"].href
+                # Get href of the item in the AR6 collection
+                href = get_item_asset_href(STAC_url, "slp", f"{ssp}\{msl}\{year}.tif")
 
                 # Load tif into xarray
                 ds = rio.open_rasterio(href, masked=True)
@@ -202,7 +196,8 @@ def get_slps_data(polygon: Polygon) -> dict:
 
 def create_slr_plot(slps: dict):
 
-    fig, ax = plt.subplots(1,1, figsize=(5,5))
+    fig = Figure(figsize=(5,5))
+    ax = fig.subplots(1,1)
 
     ssps = ["high_end", "ssp126", "ssp245", "ssp585"]
 
@@ -219,4 +214,4 @@ def create_slr_plot(slps: dict):
     ax.set_xticks(ssp_years, ssp_years, rotation=45)
     ax.legend()
 
-    return plot_to_base64(fig)
\ No newline at end of file
+    return encode_figure(fig, slot="half")
\ No newline at end of file
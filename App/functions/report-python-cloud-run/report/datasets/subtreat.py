@@ -1,6 +1,7 @@
 # Packages for loading data
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import xarray as xr
 # Packages for plotting
 from resilientplotterclass import rpc
@@ -13,13 +14,12 @@ from shapely import Polygon
 import rioxarray as rio
 from rioxarray.merge import merge_arrays
 
-from .utils import plot_to_base64
-from utils.stac import STACClientGCA
+from .encoding import encode_figure
+from utils.stac import get_client
 from .datasetcontent import DatasetContent
+from .rendering import render_plot
+from .world import plot_world_boundary
 
-world = gpd.read_file(
-        Path(__file__).parent.parent.parent / "data" / "world_administrative.zip"
-    )
 
 # def get_sub_threat_content(xarr: xr.Dataset) -> DatasetContent:
 #     """Get content for the dataset"""
@@ -27,12 +27,12 @@ world = gpd.read_file(
 #     title = "Land Subsidence"
 #     text = "Here we generate some content based on the dataset" ##TODO
 
-#     image_base64 = create_sub_treat_plot(xarr)
+#     image_src = create_sub_treat_plot(xarr)
 #     return DatasetContent(
 #         dataset_id=dataset_id,
 #         title=title,
 #         text=text,
-#         image_base64=image_base64,
+#         image_src=image_src,
 #     )
 
 def get_landsub_content(polygon: Polygon) -> list[DatasetContent]:
@@ -43,8 +43,7 @@ def get_landsub_content(polygon: Polygon) -> list[DatasetContent]:
     return dataset_contents_list
 
 def get_landsub2040_content(polygon:Polygon) -> DatasetContent:
-    rasteridlist = find_extent(polygon)
-    combinedraster = get_raster('Haz-Land_Sub_2040_COGs', rasteridlist)
+    combinedraster = get_raster('Haz-Land_Sub_2040_COGs', polygon)
     clippedraster  = clip_raster(polygon, combinedraster)
 
     """Get content for the dataset"""
@@ -52,17 +51,16 @@ def get_landsub2040_content(polygon:Polygon) -> DatasetContent:
     title = "Land Subsidence in 2040"
     text = "Here we generate some content based on the dataset" ##TODO
 
-    image_base64 = create_landsub_plot(polygon, clippedraster)
+    image_src = render_plot(create_landsub_plot, polygon, clippedraster)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
     )
 
 def get_landsub2010_content(polygon:Polygon) -> DatasetContent:
-    rasteridlist = find_extent(polygon)
-    combinedraster = get_raster('Haz-Land_Sub_2010_COGs', rasteridlist)
+    combinedraster = get_raster('Haz-Land_Sub_2010_COGs', polygon)
     clippedraster  = clip_raster(polygon, combinedraster)
 
     """Get content for the dataset"""
@@ -70,22 +68,19 @@ def get_landsub2010_content(polygon:Polygon) -> DatasetContent:
     title = "Land Subsidence in 2010"
     text = "Here we generate some content based on the dataset" ##TODO
 
-    image_base64 = create_landsub_plot(polygon, clippedraster)
+    image_src = render_plot(create_landsub_plot, polygon, clippedraster)
     return DatasetContent(
         dataset_id=dataset_id,
         title=title,
         text=text,
-        image_base64=image_base64,
+        image_src=image_src,
     )
 
 
 
 def create_sub_treat_plot(xarr: xr.Dataset):
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
-
-    base = world.boundary.plot(
-        ax=ax, edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-    )
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots(1, 1)
 
     p = rpc.scatter(xarr, ax=ax, data_type='data',
                     x='lon', y='lat', 
@@ -106,6 +101,8 @@ def create_sub_treat_plot(xarr: xr.Dataset):
     xlim = [lonmin - 0.1, lonmax + 0.1]
     ylim = [latmin - 0.1, latmax + 0.1]
 
+    base = plot_world_boundary(ax, xlim, ylim)
+
     ax.set(
         xlim=xlim,
         ylim=ylim,
@@ -117,43 +114,21 @@ def create_sub_treat_plot(xarr: xr.Dataset):
     fig.tight_layout()
 
 
-    return plot_to_base64(fig)
-
-
-def find_extent(polygon: Polygon) -> list:
-    polyx = polygon.exterior.xy[0]
-    polyy = polygon.exterior.xy[1]
-
-    minx  = min(polyx)
-    miny  = min(polyy)
-    maxx  = max(polyx)
-    maxy  = max(polyy)
-
-    extentx = [divmod(minx,1)[0] // 3 * 3, (divmod(maxx,1)[0] // 3 + 1) * 3]
-    extenty = [np.round(miny,0) // 3 * 3 - 1, (np.round(maxy,0) // 3 + 1) * 3 - 1]
+    return encode_figure(fig)
 
-    xlist = np.arange(divmod(minx,1)[0] // 3 * 3, (divmod(maxx,1)[0] // 3 + 2) * 3, 3) ##TODO: now hard coded to have additional one tile -> to be improved
-    ylist = np.arange(divmod(miny,1)[0] // 3 * 3 - 1, (divmod(maxy,1)[0] // 3 + 2) * 3 - 1, 3)
 
-    rasteridlist = []
-    
-    for y in ylist:
-        for x in xlist:
-            idname = "B01_x" + str(x) + "_" + "y" + str(y)
-            rasteridlist.append(idname)
-
-    return rasteridlist
-
-
-def get_raster(collectionid: str, rasteridlist: list):
+def get_raster(collectionid: str, polygon: Polygon):
     stac = 'https://storage.googleapis.com/dgds-data-public/gca/SOTC/gca-sotc/catalog.json'
 
+    # only the COG tiles that actually intersect the polygon
+    items = get_client(stac).query_items(collectionid, polygon, 'band_data')
+    if not items:
+        raise ValueError(f"No {collectionid} tiles intersect the polygon")
+
     rasterlist = []
-    
-    for rasterid in rasteridlist:
-        gca_client = STACClientGCA.open(stac)
-        href = gca_client.get_child(collectionid).get_item(rasterid).assets['band_data'].href
-        raster = rio.open_rasterio(href, masked=True)
+
+    for item in items:
+        raster = rio.open_rasterio(item.href, masked=True)
         rasterlist.append(raster)
 
     combinedraster = merge_arrays(dataarrays=rasterlist, method='sum')
@@ -167,13 +142,10 @@ def clip_raster(polygon:Polygon, raster):
 
 
 def create_landsub_plot(polygon: Polygon, clip):
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
-
-    base = world.boundary.plot(
-        ax=ax, edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
-    )
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots(1, 1)
 
-    clip.plot()
+    clip.plot(ax=ax)
 
     lonmin = min(polygon.exterior.xy[0])
     lonmax = max(polygon.exterior.xy[0])
@@ -183,6 +155,8 @@ def create_landsub_plot(polygon: Polygon, clip):
     xlim = [lonmin - 0.1, lonmax + 0.1]
     ylim = [latmin - 0.1, latmax + 0.1]
 
+    base = plot_world_boundary(ax, xlim, ylim)
+
     ax.set(
         xlim=xlim,
         ylim=ylim,
@@ -194,4 +168,4 @@ def create_landsub_plot(polygon: Polygon, clip):
     fig.tight_layout()
 
 
-    return plot_to_base64(fig)
\ No newline at end of file
+    return encode_figure(fig)
\ No newline at end of file
@@ -0,0 +1,39 @@
+import threading
+from pathlib import Path
+from typing import Optional
+
+import geopandas as gpd
+import matplotlib.pyplot as plt
+import shapely  # type: ignore
+
+WORLD_PATH = Path(__file__).parent.parent.parent / "data" / "world_administrative.zip"
+
+_world_boundary: Optional[gpd.GeoSeries] = None
+_world_boundary_lock = threading.Lock()
+
+
+def get_world_boundary() -> gpd.GeoSeries:
+    """Get the administrative boundaries of the world, loaded once per process"""
+    global _world_boundary
+    with _world_boundary_lock:
+        if _world_boundary is None:
+            boundary = gpd.read_file(WORLD_PATH).boundary
+            # build the spatial index up front rather than on the first request
+            boundary.sindex
+            _world_boundary = boundary
+    return _world_boundary
+
+
+def get_world_boundary_in_extent(xlim: list[float], ylim: list[float]) -> gpd.GeoSeries:
+    """Get the boundary segments within the plot extent"""
+    boundary = get_world_boundary()
+    extent = shapely.box(xlim[0], ylim[0], xlim[1], ylim[1])
+    indices = boundary.sindex.query(extent, predicate="intersects")
+    return boundary.iloc[indices].clip(extent)
+
+
+def plot_world_boundary(ax: plt.Axes, xlim: list[float], ylim: list[float]) -> plt.Axes:
+    """Plot the world boundaries within the plot extent as background"""
+    return get_world_boundary_in_extent(xlim, ylim).plot(
+        ax=ax, edgecolor="grey", facecolor="grey", alpha=0.1, zorder=0
+    )
@@ -1,17 +1,31 @@
 # %%
+import base64
 from dataclasses import dataclass
+from functools import partial
 from io import BytesIO
+from itertools import count
+import os
 from pathlib import Path
-import fitz  # type: ignore
-from jinja2 import Template, Environment, FileSystemLoader
+import re
+import shutil
+import tempfile
+import traceback
+from typing import IO, Iterator, Optional
 from shapely import Polygon  # type: ignore
-import weasyprint
 
-from utils.stac import STACClientGCA, ZarrDataset
-from utils.zarr_slicing import ZarrSlicer
+from utils.stac import ZarrDataset, get_catalog_version, get_zarr_datasets
+from utils.zarr_slicing import ZarrSlicer, get_station_index
+from utils.concurrency import iter_concurrently, report_flight, run_concurrently
+from utils.gentext import describe_overview, describe_report, describe_sections
+from utils.report_cache import content_key, polygon_key, report_cache
+from utils.metrics import REPORT_METRICS_HEADER, metrics, stage, trace_report
+from utils.pdf_layout import write_report_pdf
+from utils.render_context import get_render_context
 from datasets.datasetcontent import DatasetContent
+from datasets.encoding import FIGURE_ASSET_DIR, resolve_asset_urls, touch_assets
 from datasets.base_dataset import get_dataset_content
-from datasets.overview import get_overview
+from datasets.overview import get_overview, create_overview_img
+from datasets.rendering import render_plot
 from datasets.slr import get_slr_content
 from datasets.subtreat import get_landsub_content
 from datetime import datetime
@@ -20,133 +34,411 @@ POLYGON_DEFAULT = """{"coordinates":[[[2.3915028831735015,51.7360381463356],[5.0
 STAC_ROOT_DEFAULT = "https://raw.githubusercontent.com/openearth/global-coastal-atlas/subsidence_etienne/STAC/data/current/catalog.json"
 STAC_COCLICO = "https://raw.githubusercontent.com/openearth/coclicodata/main/current/catalog.json"
 
+# PDFs larger than this are spooled to disk while they are generated
+PDF_SPOOL_BYTES = int(os.getenv("PDF_SPOOL_BYTES", str(16 * 2**20)))
+# marks the html of a report that is missing sections of tasks that timed
+# out, it is served but not cached
+INCOMPLETE_MARKER = "<!-- report-incomplete -->"
+DATA_URI_PATTERN = re.compile(r'data:image/(png|jpeg|webp|svg\+xml);base64,([A-Za-z0-9+/=]+)')
+
+# order of the sections in the report, sections not listed are left out
+SECTION_ORDER = ['overview', 'dtm', 'sediment_class', 'world_pop', 'flooding', 'shoreline_change',
+                 'landsub2010', 'landsub2040', 'slr', 'esl',
+                 'future_shoreline_change_2050','future_shoreline_change_2100']
+
+
+class ReportStreamClosed(RuntimeError):
+    """The client of a report stream left before the report was rendered"""
+
 
 @dataclass
 class ReportContent:
     datasets: list[DatasetContent]
+    # False when tasks timed out and their sections are missing
+    complete: bool = True
+
+
+@dataclass
+class BuiltReport:
+    html: str
+    # temporary file holding the PDF, removed by discard
+    pdf_path: str
+
+    def discard(self):
+        Path(self.pdf_path).unlink(missing_ok=True)
+
+
+def get_report_html_key(polygon: Polygon) -> str:
+    return content_key("html", polygon_key(polygon), get_catalog_version(STAC_ROOT_DEFAULT))
+
+
+def get_cached_report_html(polygon: Polygon) -> Optional[str]:
+    return get_cached_html(get_report_html_key(polygon))
+
+
+def get_cached_html(cache_key: str) -> Optional[str]:
+    """Cached report html, None when it is not cached or its figures have
+    been evicted from the asset store"""
+    cached_html = report_cache.get(cache_key)
+    if cached_html is None:
+        return None
+    html = cached_html.decode()
+    if not touch_assets(html):
+        return None
+    return html
 
 
 def create_report_html(polygon: Polygon, stac_root: str) -> str:
-    env = Environment(loader=FileSystemLoader('.'))
-    htmlpath = Path(__file__).parent / Path("template.html.jinja")
-    csspath = Path(__file__).parent / Path("template.css")
+    cache_key = get_report_html_key(polygon)
+    cached_html = get_cached_html(cache_key)
+    if cached_html is not None:
+        return cached_html
+
+    # concurrent requests for the same polygon share one build, which is
+    # cached before the flight ends so later requests find it in the cache
+    build = partial(render_and_cache_report_html, polygon, cache_key)
+    try:
+        html, _ = report_flight.do(cache_key, build)
+    except ReportStreamClosed:
+        # the flight was a stream that was left early, build the report here
+        html, _ = report_flight.do(cache_key, build)
+    return html
 
-    with htmlpath.open() as f:
-        #template = jinja2.Template(f.read())
-        template = env.get_template('template.html.jinja')
 
-    data = generate_report_content(polygon=polygon)
-    css: str = csspath.read_bytes().decode()
-    html = template.render(data=data, css=css)
+def render_and_cache_report_html(polygon: Polygon, cache_key: str) -> str:
+    # a flight that ended between the cache miss and this one starting has
+    # cached the report already
+    cached_html = get_cached_html(cache_key)
+    if cached_html is not None:
+        return cached_html
 
+    html = render_report_html(polygon)
+    if INCOMPLETE_MARKER not in html:
+        report_cache.set(cache_key, html.encode())
     return html
 
 
+def render_report_html(polygon: Polygon) -> str:
+    return render_report_content(generate_report_content(polygon=polygon))
+
+
+def render_report_content(data: ReportContent) -> str:
+    render_context = get_render_context()
+
+    with stage("html"):
+        html = render_context.report_template.render(data=data, css=render_context.css)
+    if not data.complete:
+        html = INCOMPLETE_MARKER + html
+
+    return html
+
+
+def stream_report_html(polygon: Polygon) -> Iterator[str]:
+    """Render the report html progressively: the shell right away, then each
+    section as soon as it is ready and the overview last. The sections are
+    placed in report order by CSS, whatever order they arrive in
+
+    The stream is the flight of create_report_html for the polygon: when
+    every section arrived the report is cached, and requests for the same
+    report wait for the stream instead of building it again.
+    """
+    cache_key = get_report_html_key(polygon)
+    future, leader = report_flight.start(cache_key)
+    if not leader:
+        # the report is being built for another request, send it in one piece
+        try:
+            yield future.result()
+        except ReportStreamClosed:
+            yield create_report_html(polygon, STAC_ROOT_DEFAULT)
+        return
+
+    html = None
+    try:
+        html = get_cached_html(cache_key)
+        if html is not None:
+            yield html
+            return
+
+        render_context = get_render_context()
+        template = render_context.stream_template
+        yield template.render(part="head", css=render_context.css)
+
+        sections: list[DatasetContent] = []
+        overview = None
+        complete = False
+        try:
+            tasks = get_report_section_tasks(polygon)
+            finished = set()
+            overview_img = None
+            for key, dataset_contents in iter_concurrently(tasks):
+                finished.add(key)
+                if key == 'overview_img':
+                    overview_img = dataset_contents
+                    continue
+                sections.extend(dataset_contents)
+                for dataset in dataset_contents:
+                    if dataset.dataset_id in SECTION_ORDER:
+                        with stage("html"):
+                            section_html = template.render(part="section", dataset=dataset, order=SECTION_ORDER.index(dataset.dataset_id))
+                        yield section_html
+
+            if sections:
+                with stage("text"):
+                    overview_text = describe_overview(polygon, sections)
+                with stage("overview"):
+                    overview = get_overview(polygon, sections, image_src=overview_img, text=overview_text)
+                yield template.render(part="section", dataset=overview, order=SECTION_ORDER.index("overview"))
+            complete = finished == tasks.keys()
+        except Exception:
+            # the response has started, close the page rather than cut it off
+            print("failed to stream report, closing the page")
+            traceback.print_exc()
+
+        # the report as create_report_html renders it, for the cache and the
+        # requests waiting for this flight
+        datasets = order_sections(sections + ([overview] if overview else []))
+        html = render_report_content(ReportContent(datasets=datasets, complete=complete))
+        if complete and sections:
+            report_cache.set(cache_key, html.encode())
+        elif not complete:
+            print('streamed report is missing sections, it will not be cached')
+
+        yield template.render(part="tail", empty=not sections)
+    finally:
+        if html is not None:
+            future.set_result(html)
+        else:
+            future.set_exception(ReportStreamClosed(f"report stream {cache_key} was closed before the report was rendered"))
+        report_flight.end(cache_key)
+
+
 def create_report_pdf(page_content: str) -> BytesIO: ##TODO
-    in_memory_pdf = BytesIO()
-    weasyprint.HTML(string=page_content, base_url='.').write_pdf(in_memory_pdf)
+    with create_report_pdf_file(page_content) as pdf_file:
+        return BytesIO(pdf_file.read())
+
+
+def create_report_pdf_file(page_content: str) -> IO[bytes]:
+    """Render the report html to a PDF file object positioned at its start,
+    for streaming it to the client. The caller closes the file"""
+    # keyed by the html, which is itself cached per polygon and catalog version
+    cache_key = content_key("pdf", page_content)
+    cached_pdf = report_cache.open(cache_key)
+    if cached_pdf is not None:
+        return cached_pdf
+
+    # concurrent requests for the same report wait for one render and then
+    # read it from the cache, the file object itself can't be shared
+    pdf_file, shared = report_flight.do(cache_key, partial(render_report_pdf, page_content, cache_key))
+    if not shared:
+        return pdf_file
+
+    cached_pdf = report_cache.open(cache_key)
+    if cached_pdf is not None:
+        return cached_pdf
+    return render_report_pdf(page_content, cache_key)
+
+
+def render_report_pdf(page_content: str, cache_key: str) -> IO[bytes]:
+    """Render the report html to a spooled PDF file and store it in the cache,
+    unless the report is incomplete"""
+    # a flight that ended between the cache miss and this one starting has
+    # cached the PDF already
+    cached_pdf = report_cache.open(cache_key)
+    if cached_pdf is not None:
+        return cached_pdf
+
+    pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+    with stage("pdf"), tempfile.TemporaryDirectory() as asset_dir:
+        # let WeasyPrint load the figures from files instead of inlined data URIs,
+        # relative URLs such as the logos of template.css resolve in the package
+        html = resolve_asset_urls(externalise_images(page_content, Path(asset_dir)))
+        write_report_pdf(html, pdf_file, base_url=str(Path(__file__).parent))
 
-    return in_memory_pdf
+    if INCOMPLETE_MARKER not in page_content:
+        pdf_file.seek(0)
+        report_cache.set_file(cache_key, pdf_file)
+    pdf_file.seek(0)
+    return pdf_file
+
+
+def build_report(polygon: Polygon) -> BuiltReport:
+    """Build the html and PDF of a report for a background job. The PDF is
+    kept in a temporary file until the report is discarded, so it is served
+    without rendering it again, also when the report cache evicted it or the
+    report is incomplete and was never cached
+
+    Returns:
+        BuiltReport: report html and PDF
+    """
+    html = create_report_html(polygon=polygon, stac_root=STAC_ROOT_DEFAULT)
+    fd, pdf_path = tempfile.mkstemp(prefix="report-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f, create_report_pdf_file(html) as pdf_file:
+            shutil.copyfileobj(pdf_file, f)
+    except BaseException:
+        Path(pdf_path).unlink(missing_ok=True)
+        raise
+    return BuiltReport(html=html, pdf_path=pdf_path)
+
+
+def externalise_images(html: str, asset_dir: Path) -> str:
+    """Write the base64 data URI images in html to asset_dir and reference them by absolute file URL"""
+    extensions = {"png": "png", "jpeg": "jpg", "webp": "webp", "svg+xml": "svg"}
+    counter = count()
+
+    def write_image(match: re.Match) -> str:
+        name = f"image-{next(counter)}.{extensions[match.group(1)]}"
+        (asset_dir / name).write_bytes(base64.b64decode(match.group(2)))
+        return (asset_dir / name).resolve().as_uri()
+
+    return DATA_URI_PATTERN.sub(write_image, html)
+
+
+def traced(stage_name: str, func, *args):
+    """Call func(*args) as stage stage_name"""
+    with stage(stage_name):
+        return func(*args)
+
+
+def get_zarr_dataset_content(zarr_dataset: ZarrDataset, polygon: Polygon) -> list[DatasetContent]:
+    """Open, slice and render a single GCA Zarr dataset"""
+    zarr_uri = zarr_dataset.zarr_uri
+    # the scatter layers of large polygons are drawn from a pre-aggregated
+    # level, if the store has one; statistics use the full resolution slice
+    level_uri = ZarrSlicer.get_multiscale_url(zarr_uri, zarr_dataset.multiscales, polygon)
+    with stage("open"):
+        xarr = ZarrSlicer._get_dataset_from_zarr_url(zarr_uri)
+        level_xarr = ZarrSlicer._get_dataset_from_zarr_url(level_uri) if level_uri != zarr_uri else None
+    with stage("slice"):
+        sliced_xarr = slice_dataset(zarr_uri, xarr, polygon)
+        if not ZarrSlicer.check_xarr_contains_data(sliced_xarr):
+            return []
+        scatter_xarr = None
+        if level_xarr is not None:
+            scatter_xarr = slice_dataset(level_uri, level_xarr, polygon)
+
+    with stage("content"):
+        dataset_content = get_dataset_content(zarr_dataset.dataset_id, sliced_xarr, scatter_xarr)
+    if not dataset_content:
+        return []
+    if isinstance(dataset_content, list):
+        return dataset_content
+    return [dataset_content]
+
+
+def slice_dataset(zarr_uri: str, xarr, polygon: Polygon):
+    """Slice the dataset of the store at zarr_uri with polygon"""
+    station_index = get_station_index(zarr_uri, xarr)
+    sliced_xarr = ZarrSlicer.slice_xarr_with_polygon(xarr, polygon, station_index)
+    return sliced_xarr.rio.write_crs('EPSG:4326')
 
 
 def generate_report_content(polygon: Polygon) -> ReportContent:
+    # concurrent requests for the same polygon share one build
+    report_content, _ = report_flight.do(
+        content_key("content", polygon_key(polygon)),
+        partial(build_report_content, polygon),
+    )
+    return report_content
+
+
+def get_report_tasks(polygon: Polygon, zarr_datasets: list[ZarrDataset]) -> dict:
+    """Independent tasks making up the report content, keyed by dataset id
+
+    All datasets, SLR and the overview map are independent of each other, so
+    they are fetched and rendered concurrently. Only the overview text has to
+    wait for the other sections.
+    """
+    tasks = {
+        zarr_dataset.dataset_id: partial(get_zarr_dataset_content, zarr_dataset, polygon)
+        for zarr_dataset in zarr_datasets
+    }
+    tasks['slr'] = partial(traced, "content", get_slr_content, polygon)
+    tasks['overview_img'] = partial(render_plot, create_overview_img, polygon)
+
+    # ### getting land subsidence ###
+    # tasks['land_sub'] = partial(get_landsub_content, polygon)
+
+    # ### getting DTM ### ##TODO
+    return tasks
+
+
+def get_report_section_tasks(polygon: Polygon) -> dict:
+    """Report tasks that also describe their sections, and the overview image
+    under the key "overview_img", for streaming each section as soon as it
+    is ready"""
+    with stage("catalog"):
+        zarr_datasets = get_zarr_datasets(STAC_ROOT_DEFAULT)
+
+    def describe(task):
+        dataset_contents = task()
+        if not dataset_contents:
+            return []
+        if not isinstance(dataset_contents, list):
+            dataset_contents = [dataset_contents]
+        with stage("text"):
+            describe_sections(dataset_contents)
+        return dataset_contents
+
+    tasks = get_report_tasks(polygon, zarr_datasets)
+    return {
+        key: task if key == 'overview_img' else partial(describe, task)
+        for key, task in tasks.items()
+    }
+
+
+def order_sections(dataset_contents: list[DatasetContent]) -> list[DatasetContent]:
+    """Sections in report order, leaving out the ones not in SECTION_ORDER"""
+    existing_collection = [dataset_content.dataset_id for dataset_content in dataset_contents]
+    return [
+        dataset_contents[existing_collection.index(item)]
+        for item in SECTION_ORDER
+        if item in existing_collection
+    ]
+
+
+def build_report_content(polygon: Polygon) -> ReportContent:
     start = datetime.now()
 
     dataset_contents: list[DatasetContent] = []
-    final_dataset_contents: list[DatasetContent] = []
     
     
     ### getting gca datasets ###
-    time = datetime.now()
-    print('start retrieving gca dataset {}'.format(time - start))
-
-    gca_client = STACClientGCA.open(STAC_ROOT_DEFAULT)
-    zarr_datasets: list[ZarrDataset] = gca_client.get_all_zarr_uris()
-
-    for zarr_dataset in zarr_datasets:
-        xarr = ZarrSlicer._get_dataset_from_zarr_url(zarr_dataset.zarr_uri)
-        sliced_xarr = ZarrSlicer.slice_xarr_with_polygon(xarr, polygon)
-        sliced_xarr = sliced_xarr.rio.write_crs('EPSG:4326')
-        if ZarrSlicer.check_xarr_contains_data(sliced_xarr):
-            dataset_content = get_dataset_content(zarr_dataset.dataset_id, sliced_xarr)
-            if dataset_content:
-                if isinstance(dataset_content,list):
-                    dataset_contents.extend(dataset_content)
-                else:
-                    dataset_contents.append(dataset_content)
-
-    time = datetime.now()                
-    print('finished retrieving gca dataset {}'.format(time - start))
-
-    ## getting SLR ###
-    time = datetime.now()
-    print('start retrieving slr dataset {}'.format(time - start))
-    dataset_content = get_slr_content(polygon)
-    if dataset_content:
-        if isinstance(dataset_content,list):
-            dataset_contents.extend(dataset_content)
-        else:
-            dataset_contents.append(dataset_content)
-    
-    time = datetime.now()
-    print('finished retrieving slr dataset {}'.format(time - start))
-
-    # ### getting land subsidence ### 
-    # time = datetime.now()
-    # print('start retrieving landsub dataset {}'.format(time - start))
-    # dataset_content = get_landsub_content(polygon)
-    # if dataset_content:
-    #     if isinstance(dataset_content,list):
-    #         dataset_contents.extend(dataset_content)
-    #     else:
-    #         dataset_contents.append(dataset_content)
-    # time = datetime.now()
-    # print('finished retrieving landsub dataset {}'.format(time - start))
+    print('start retrieving gca dataset {}'.format(datetime.now() - start))
 
-    # ### getting DTM ### ##TODO
+    with stage("catalog"):
+        zarr_datasets: list[ZarrDataset] = get_zarr_datasets(STAC_ROOT_DEFAULT)
+
+    tasks = get_report_tasks(polygon, zarr_datasets)
+    results = run_concurrently(tasks)
+    complete = results.keys() == tasks.keys()
+    if not complete:
+        print(f'report is missing {sorted(tasks.keys() - results.keys())}, it will not be cached')
+    overview_img = results.pop('overview_img', None)
+
+    for dataset_content in results.values():
+        if dataset_content:
+            if isinstance(dataset_content,list):
+                dataset_contents.extend(dataset_content)
+            else:
+                dataset_contents.append(dataset_content)
 
+    print('finished retrieving gca and slr dataset {}'.format(datetime.now() - start))
 
+    ### generating texts ###
+    print('start generating texts {}'.format(datetime.now() - start))
+    with stage("text"):
+        overview_text = describe_report(polygon, dataset_contents)
+    print('finished generating texts {}'.format(datetime.now() - start))
 
     ### generating overview ###
-    print('start making overview {}'.format(time - start))
-    dataset_content = get_overview(polygon, dataset_contents)
+    print('start making overview {}'.format(datetime.now() - start))
+    with stage("overview"):
+        dataset_content = get_overview(polygon, dataset_contents, image_src=overview_img, text=overview_text)
     dataset_contents.append(dataset_content)
-    print('finished making overview {}'.format(time - start))
+    print('finished making overview {}'.format(datetime.now() - start))
     
     ### re-arranging datasets ###
-    collection_dict = ['overview', 'dtm', 'sediment_class', 'world_pop', 'flooding', 'shoreline_change',
-                        'landsub2010', 'landsub2040', 'slr', 'esl', 
-                        'future_shoreline_change_2050','future_shoreline_change_2100']
-        
-    existing_collection = [dataset_contents[ind].dataset_id for ind in range(len(dataset_contents))]
-
-    for item in collection_dict:
-        if item in existing_collection:
-            final_dataset_contents.append(dataset_contents[existing_collection.index(item)])
-        else:
-            None
-
-    return ReportContent(datasets=final_dataset_contents)
+    final_dataset_contents = order_sections(dataset_contents)
 
-
-#%%for testing only
-
-### Test Case 1: Terschelling; Case 2: Aveiro, Portugal; Case 3: Po Delta, Italy ###
-name     = ['Terschelling', 'Aveiro', 'PoDelta']
-polylist = [Polygon([(5.0713, 53.3602), (5.2567, 53.44), (5.5281, 53.4646), (5.6351, 53.4086), (5.1669, 53.3079), (5.0713, 53.3602)]),
-            Polygon([(-8.8754, 40.7728), (-8.6110, 40.7749), (-8.6067, 40.5479), (-8.8719, 40.5444), (-8.8754, 40.7728)]),
-            Polygon([(12.1953, 45.1659), (12.6634, 45.1680), (12.6733, 44.7430), (12.2017, 44.7437), (12.1953, 45.1659)])]
-
-for nn in range(1):
-    if __name__ == "__main__":
-        html = create_report_html(polygon=polylist[nn], stac_root=STAC_ROOT_DEFAULT)
-        print(html)
-        pdf = create_report_pdf(html)
-        print(pdf.getvalue())
-
-        # Write pdf to file
-        with open("report-" + name[nn] + ".html", "w") as f:
-            f.write(html)
-        with open("report-" + name[nn] + ".pdf", "wb") as f:
-            f.write(pdf.getvalue())
-# %%
+    return ReportContent(datasets=final_dataset_contents, complete=complete)
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from .metrics import metrics
+
+ZARR_CHUNK_CACHE_DIR = os.getenv(
+    "ZARR_CHUNK_CACHE_DIR", str(Path(tempfile.gettempdir()) / "gca-chunk-cache")
+)
+ZARR_CHUNK_CACHE_BYTES = int(os.getenv("ZARR_CHUNK_CACHE_BYTES", str(10 * 2**30)))
+
+
+def chunk_namespace(url: str, zmetadata: bytes) -> str:
+    """Cache namespace of a store: changes whenever its consolidated metadata
+    changes, so chunks of a rewritten store are never served from the cache"""
+    return hashlib.sha256(url.encode() + b"\0" + zmetadata).hexdigest()
+
+
+def chunk_key(namespace: str, key: str) -> str:
+    return hashlib.sha256(f"{namespace}/{key}".encode()).hexdigest()
+
+
+class ChunkCache:
+    """Read-through cache of remote Zarr chunks on local disk
+
+    Entries are evicted least recently used first once the total size exceeds
+    ``max_bytes``; a cap of 0 disables the cache. Recency survives restarts
+    through the modification time of the files.
+    """
+
+    def __init__(self, cache_dir: str = ZARR_CHUNK_CACHE_DIR, max_bytes: int = ZARR_CHUNK_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: Optional[OrderedDict[str, int]] = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            value = path.read_bytes()
+            path.touch()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            entries = self._load_entries()
+            if key in entries:
+                entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(value)
+            tmp_path.replace(path)
+        except OSError as e:
+            print(f"failed to write chunk cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            entries = self._load_entries()
+            self._bytes += len(value) - entries.pop(key, 0)
+            entries[key] = len(value)
+            while self._bytes > self.max_bytes:
+                evicted, size = entries.popitem(last=False)
+                self._path(evicted).unlink(missing_ok=True)
+                self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": len(self._entries or ()),
+                "bytes": self._bytes,
+            }
+
+    def render_metrics(self) -> list[str]:
+        """Cache statistics in the Prometheus text format"""
+        stats = self.stats()
+        return [
+            "# HELP gca_zarr_chunk_cache_requests_total Chunk cache lookups by result",
+            "# TYPE gca_zarr_chunk_cache_requests_total counter",
+            f'gca_zarr_chunk_cache_requests_total{{result="hit"}} {stats["hits"]}',
+            f'gca_zarr_chunk_cache_requests_total{{result="miss"}} {stats["misses"]}',
+            "# HELP gca_zarr_chunk_cache_bytes Size of the chunks in the cache",
+            "# TYPE gca_zarr_chunk_cache_bytes gauge",
+            f'gca_zarr_chunk_cache_bytes {stats["bytes"]}',
+        ]
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def _load_entries(self) -> OrderedDict[str, int]:
+        """Index of the entries on disk in LRU order, read on first use;
+        the caller holds the lock"""
+        if self._entries is None:
+            entries = []
+            if self.cache_dir.exists():
+                for path in self.cache_dir.glob("*/*"):
+                    if path.suffix == ".tmp":
+                        continue
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, path.name, stat.st_size))
+            self._entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+            self._bytes = sum(self._entries.values())
+        return self._entries
+
+
+chunk_cache = ChunkCache()
+metrics.register_collector(chunk_cache.render_metrics)
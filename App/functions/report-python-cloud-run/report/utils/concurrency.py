@@ -0,0 +1,195 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterator, Optional
+
+REPORT_MAX_WORKERS = int(os.getenv("REPORT_MAX_WORKERS", "8"))
+# seconds a report task may take from when it starts
+REPORT_DATASET_TIMEOUT = float(os.getenv("REPORT_DATASET_TIMEOUT", "300"))
+
+
+def run_concurrently(
+    tasks: dict[str, Callable[[], Any]],
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> dict[str, Any]:
+    """Run independent report tasks in a thread pool
+
+    The report stages spend most of their time waiting on remote Zarr stores,
+    COGs and the LLM, so threads are sufficient to overlap them.
+
+    Args:
+        tasks (dict[str, Callable]): mapping of task key to zero-argument callable
+        max_workers (int, optional): degree of parallelism, defaults to REPORT_MAX_WORKERS
+        timeout (float, optional): seconds each task may take from when it
+            starts, defaults to REPORT_DATASET_TIMEOUT
+
+    Returns:
+        dict[str, Any]: results keyed like ``tasks``, in the same order; tasks that
+            timed out are left out
+    """
+    finished = dict(_iter_finished(tasks, max_workers, timeout))
+    # re-raise task errors as the sequential implementation did
+    return {key: finished[key].result() for key in tasks if key in finished}
+
+
+def iter_concurrently(
+    tasks: dict[str, Callable[[], Any]],
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[tuple[str, Any]]:
+    """Run independent report tasks in a thread pool and yield their results
+    as soon as they finish
+
+    Args:
+        tasks (dict[str, Callable]): mapping of task key to zero-argument callable
+        max_workers (int, optional): degree of parallelism, defaults to REPORT_MAX_WORKERS
+        timeout (float, optional): seconds each task may take from when it
+            starts, defaults to REPORT_DATASET_TIMEOUT
+
+    Returns:
+        Iterator[tuple[str, Any]]: (key, result) in order of completion; tasks that
+            failed or timed out are logged and left out, as the caller may
+            already have sent part of its response
+    """
+    for key, future in _iter_finished(tasks, max_workers, timeout):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"task {key} failed, skipping: {e!r}")
+            continue
+        yield key, result
+
+
+def _iter_finished(
+    tasks: dict[str, Callable[[], Any]],
+    max_workers: Optional[int],
+    timeout: Optional[float],
+) -> Iterator[tuple[str, Future]]:
+    """Run tasks in a thread pool and yield (key, future) as they finish
+
+    Each task is timed from when it starts rather than from when it was
+    queued. Threads can't be stopped, so a task that timed out keeps its
+    worker; once every worker is held by such a task, the queued tasks can't
+    start and are left out as well.
+    """
+    if not tasks:
+        return
+
+    max_workers = min(max_workers or REPORT_MAX_WORKERS, len(tasks))
+    timeout = timeout if timeout is not None else REPORT_DATASET_TIMEOUT
+    started: dict[str, float] = {}
+
+    def run(key: str, task: Callable[[], Any]) -> Any:
+        started[key] = time.monotonic()
+        return task()
+
+    # tasks run in a copy of the caller's context, so they are traced as part
+    # of the caller's report
+    executor = ContextThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report")
+    try:
+        futures = {executor.submit(run, key, task): key for key, task in tasks.items()}
+        pending = set(futures)
+        timed_out: list[Future] = []
+        while pending:
+            now = time.monotonic()
+            # tasks that have not started yet time out at least timeout from now
+            wait_timeout = min(
+                [started[futures[f]] + timeout - now for f in pending if futures[f] in started] + [timeout]
+            )
+            done, pending = wait(pending, timeout=max(wait_timeout, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures[future], future
+
+            now = time.monotonic()
+            for future in list(pending):
+                key = futures[future]
+                if key in started and now - started[key] >= timeout:
+                    print(f"task {key} did not finish within {timeout}s, skipping")
+                    pending.discard(future)
+                    timed_out.append(future)
+
+            if pending and sum(not f.done() for f in timed_out) >= max_workers:
+                for future in pending:
+                    print(f"task {futures[future]} can't start, all workers hold tasks that timed out, skipping")
+                return
+    finally:
+        # don't block the request on tasks that timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool running each callable in a copy of the submitting
+    thread's context"""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """Shut down a broken or hung process pool without waiting for its workers"""
+    # ProcessPoolExecutor has no public way to stop hung workers before 3.14
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single call
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Run fn for key, or wait for the call already in flight
+
+        Returns:
+            tuple[Any, bool]: result of fn, and whether it was shared with
+                another caller rather than computed by this one
+        """
+        future, leader = self.start(key)
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.end(key)
+
+    def start(self, key: str) -> tuple[Future, bool]:
+        """Join the call in flight for key, or start one when there is none
+
+        For callers that can't wrap their work in a function, such as a
+        generator. The leader settles the future and then calls end(key).
+
+        Returns:
+            tuple[Future, bool]: future of the call, and whether the caller
+                leads it
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def end(self, key: str):
+        """End the call for key, later callers start a new one"""
+        with self._lock:
+            del self._calls[key]
+
+
+report_flight = SingleFlight()
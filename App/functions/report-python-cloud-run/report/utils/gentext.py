@@ -1,40 +1,342 @@
+import asyncio
+import hashlib
 import os
-from openai import AzureOpenAI
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing, nullcontext
+from pathlib import Path
+import openai
+from openai import AsyncAzureOpenAI, AzureOpenAI
 import numpy as np
 import xarray as xr
-from typing import Union
+from typing import Optional, Protocol, Union
+
+from .metrics import record_llm_tokens
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'azure')
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'sqlite')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', str(Path(tempfile.gettempdir()) / 'gca-llm-cache.sqlite'))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(30 * 24 * 3600)))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+LLM_REQUESTS_PER_SECOND = float(os.getenv('LLM_REQUESTS_PER_SECOND', '5'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '4'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '1'))
+
+API_VERSION = '2024-03-01-preview'
+MAX_TOKENS = 1000
+TEMPERATURE = 0.1
+
+# transient errors worth retrying with backoff
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class LLMCache(Protocol):
+    """Backend storing LLM responses by prompt hash"""
+
+    def get(self, key: str) -> Optional[str]: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+class MemoryLLMCache:
+    """In-process LLM response cache"""
+
+    def __init__(self, ttl: float = LLM_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: dict[str, tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+
+
+class SQLiteLLMCache:
+    """LLM response cache in a SQLite database on local disk, shared by all
+    workers on the machine"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, created REAL NOT NULL, response TEXT NOT NULL)'
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'SELECT response FROM responses WHERE key = ? AND created > ?',
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, created, response) VALUES (?, ?, ?)',
+                (key, time.time(), value),
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+
+class AzureChatBackend:
+    """Azure OpenAI deployment, the client is created once and reused"""
+
+    def __init__(self):
+        self.deployment_name = os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME')
+        self._client: Optional[AzureOpenAI] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> AzureOpenAI:
+        with self._lock:
+            if self._client is None:
+                self._client = AzureOpenAI(**self._client_kwargs())
+            return self._client
+
+    def async_client(self) -> AsyncAzureOpenAI:
+        """New async client; it is bound to the event loop it is used in, so
+        one is created per text generation run"""
+        return AsyncAzureOpenAI(**self._client_kwargs())
+
+    def complete(self, prompt: str) -> str:
+        response = self.client.chat.completions.create(**self._request_kwargs(prompt))
+        if response.usage is not None:
+            record_llm_tokens(response.usage.total_tokens)
+        return response.choices[0].message.content
+
+    async def acomplete(self, prompt: str, client: AsyncAzureOpenAI) -> str:
+        response = await client.chat.completions.create(**self._request_kwargs(prompt))
+        if response.usage is not None:
+            record_llm_tokens(response.usage.total_tokens)
+        return response.choices[0].message.content
+
+    def _client_kwargs(self) -> dict:
+        api_base_url = os.getenv('OPENAI_API_BASE')
+        return dict(
+            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+            api_version=API_VERSION,
+            base_url=f'{api_base_url}/deployments/{self.deployment_name}',
+        )
+
+    def _request_kwargs(self, prompt: str) -> dict:
+        return dict(
+            model=self.deployment_name,
+            messages=[
+                {'role': 'system', 'content': prompt},
+            ],
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE,
+        )
+
+
+class StubChatBackend:
+    """Offline stand-in for the LLM, returns a deterministic placeholder"""
+
+    deployment_name = 'stub'
+
+    def complete(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return f'Generated text is not available offline (prompt {digest}).'
+
+    def async_client(self) -> nullcontext:
+        return nullcontext()
+
+    async def acomplete(self, prompt: str, client: None) -> str:
+        return self.complete(prompt)
+
+
+def get_llm_cache() -> LLMCache:
+    match LLM_CACHE_BACKEND:
+        case 'sqlite':
+            return SQLiteLLMCache()
+        case 'memory':
+            return MemoryLLMCache()
+        case _:
+            raise ValueError(f'Unknown LLM cache backend {LLM_CACHE_BACKEND}')
+
+
+def get_llm_backend() -> Union[AzureChatBackend, StubChatBackend]:
+    match LLM_BACKEND:
+        case 'azure':
+            return AzureChatBackend()
+        case 'stub':
+            return StubChatBackend()
+        case _:
+            raise ValueError(f'Unknown LLM backend {LLM_BACKEND}')
+
+
+llm_cache: LLMCache = get_llm_cache()
+llm_backend = get_llm_backend()
+
+
+def prompt_key(prompt: str) -> str:
+    """Cache key of prompt, including the model settings that affect the response"""
+    key = f'{llm_backend.deployment_name}|{MAX_TOKENS}|{TEMPERATURE}|{prompt}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def complete(prompt: str) -> str:
+    """Get LLM response for prompt, identical prompts are only sent once"""
+    key = prompt_key(prompt)
+    response = llm_cache.get(key)
+    if response is None:
+        with llm_limiter:
+            response = llm_backend.complete(prompt)
+        llm_cache.set(key, response)
+    return response
+
+
+class RateLimiter:
+    """Limits the number of concurrent LLM requests of the process and spaces
+    their starts by 1 / requests_per_second
+
+    Shared by all threads and event loops: use ``with`` from blocking code and
+    ``async with`` from coroutines.
+    """
+
+    # seconds between attempts of a coroutine to get a free request slot
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, requests_per_second: float = LLM_REQUESTS_PER_SECOND):
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve_start(self) -> float:
+        """Reserve the next start time, returning the delay until it"""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self._interval
+        return delay
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        delay = self._reserve_start()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        # polled rather than waited for in a thread, so a cancelled coroutine
+        # never ends up holding a slot
+        while not self._semaphore.acquire(blocking=False):
+            await asyncio.sleep(self.POLL_INTERVAL)
+        delay = self._reserve_start()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:
+                self._semaphore.release()
+                raise
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+llm_limiter = RateLimiter()
+
+
+async def acomplete(prompt: str, client, limiter: RateLimiter = llm_limiter) -> str:
+    """Async variant of complete, retrying transient errors with exponential backoff"""
+    key = prompt_key(prompt)
+    response = await asyncio.to_thread(llm_cache.get, key)
+    if response is not None:
+        return response
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with limiter:
+                response = await llm_backend.acomplete(prompt, client)
+            break
+        except RETRYABLE_ERRORS as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = LLM_BACKOFF_BASE * 2**attempt * (1 + random.random())
+            print(f'LLM request failed ({e}), retrying in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+    await asyncio.to_thread(llm_cache.set, key, response)
+    return response
+
+
+async def adescribe_sections(dataset_contents, client, limiter: RateLimiter = llm_limiter):
+    """Fill in the text of all sections with a prompt concurrently"""
+    sections = [content for content in dataset_contents if content.prompt]
+    texts = await asyncio.gather(
+        *(acomplete(content.prompt, client, limiter) for content in sections)
+    )
+    for content, text in zip(sections, texts):
+        content.text = text
+
+
+async def adescribe_report(polygon, dataset_contents) -> str:
+    """Fill in the text of all sections with a prompt concurrently, then
+    generate the overview text from them
+
+    Returns:
+        str: overview text
+    """
+    async with llm_backend.async_client() as client:
+        await adescribe_sections(dataset_contents, client)
+        return await acomplete(make_overview_prompt(polygon, dataset_contents), client)
+
+
+def describe_report(polygon, dataset_contents) -> str:
+    """Blocking entry point of adescribe_report"""
+    return asyncio.run(adescribe_report(polygon, dataset_contents))
+
+
+def describe_sections(dataset_contents):
+    """Blocking entry point of adescribe_sections, for sections that are
+    described as soon as they are ready rather than all at once"""
+
+    async def describe():
+        async with llm_backend.async_client() as client:
+            await adescribe_sections(dataset_contents, client)
+
+    asyncio.run(describe())
+
 
 def describe_data(xarr: xr.Dataset, dataset_id: str) -> str:
      # Create prompt
     prompt = make_prompt(xarr, dataset_id)
 
-    # Load environment variables
-    api_version = '2024-03-01-preview'
-    api_base_url = os.getenv('OPENAI_API_BASE')
-    api_key = os.getenv('AZURE_OPENAI_API_KEY')
-    deployment_name = os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME')
-
-    # Initialise large language model
-    model = AzureOpenAI(
-        api_key=api_key,
-        api_version=api_version,
-        base_url=f'{api_base_url}/deployments/{deployment_name}',
-    )
+    # Trigger model
+    return complete(prompt)
+
+def describe_overview(polygon, dataset_contents) -> str:
+    prompt = make_overview_prompt(polygon, dataset_contents)
 
     # Trigger model
-    response = model.chat.completions.create(
-        model=os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME'),
-        messages=[
-            {'role': 'system', 'content': prompt},
-        ],
-        max_tokens=1000,
-        temperature=0.1,
-    )
+    return complete(prompt)
 
-    # Return response
-    return response.choices[0].message.content
 
-def describe_overview(polygon, dataset_contents) -> str:
+def make_overview_prompt(polygon, dataset_contents) -> str:
     para_list = [dataset_contents[ind].text for ind in range(len(dataset_contents))]
     coor_list = list(zip(*polygon.boundary.xy))
 
@@ -51,31 +353,7 @@ def describe_overview(polygon, dataset_contents) -> str:
     * texts: {}
     """.format(str(coor_list), str(para_list))
 
-    # Load environment variables
-    api_version = '2024-03-01-preview'
-    api_base_url = os.getenv('OPENAI_API_BASE')
-    api_key = os.getenv('AZURE_OPENAI_API_KEY')
-    deployment_name = os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME')
-
-    # Initialise large language model
-    model = AzureOpenAI(
-        api_key=api_key,
-        api_version=api_version,
-        base_url=f'{api_base_url}/deployments/{deployment_name}',
-    )
-
-    # Trigger model
-    response = model.chat.completions.create(
-        model=os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME'),
-        messages=[
-            {'role': 'system', 'content': prompt},
-        ],
-        max_tokens=1000,
-        temperature=0.1,
-    )
-
-    # Return response
-    return response.choices[0].message.content
+    return prompt
 
 
 def make_prompt(xarr: Union[xr.Dataset, dict], dataset_id: str) -> str:
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Generic, Optional, TypeVar
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_TTL = float(os.getenv("REPORT_JOB_TTL", "3600"))
+# longest seconds between two sweeps for expired jobs
+REAP_INTERVAL = 60.0
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Job(Generic[R]):
+    job_id: str
+    key: str
+    status: JobStatus = JobStatus.QUEUED
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    result: Optional[R] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status.value,
+            "created": self.created,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobQueue(Generic[T, R]):
+    """Local work queue running report builds in the background
+
+    Submitting a job with the same key as a queued or running job returns
+    that job instead of starting a second build. Finished jobs are kept for
+    ``ttl`` seconds; a background thread removes them after that and passes
+    their results to ``on_expire``.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[T], R],
+        max_workers: int = REPORT_JOB_WORKERS,
+        ttl: float = REPORT_JOB_TTL,
+        on_expire: Optional[Callable[[R], None]] = None,
+    ):
+        self.run = run
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: dict[str, Job[R]] = {}
+        self._in_flight: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        threading.Thread(target=self._reap, name="job-reaper", daemon=True).start()
+
+    def submit(self, key: str, argument: T) -> Job[R]:
+        """Queue run(argument), or return the in-flight job with the same key"""
+        with self._lock:
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                return self._jobs[job_id]
+
+            job = Job(job_id=uuid.uuid4().hex, key=key)
+            self._jobs[job.job_id] = job
+            self._in_flight[key] = job.job_id
+
+        self._executor.submit(self._run_job, job, argument)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job[R]]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def close(self):
+        """Stop the reaper and wait for the running jobs"""
+        self._closed.set()
+        self._executor.shutdown()
+
+    def _run_job(self, job: Job[R], argument: T):
+        job.status = JobStatus.RUNNING
+        try:
+            job.result = self.run(argument)
+            job.status = JobStatus.DONE
+        except Exception as e:
+            print(f"report job {job.job_id} failed: {e}")
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+
+    def _reap(self):
+        while not self._closed.wait(max(min(self.ttl, REAP_INTERVAL), 1.0)):
+            self.expire()
+
+    def expire(self):
+        """Remove the jobs that finished more than ttl seconds ago"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                self._jobs.pop(job_id)
+                for job_id, job in list(self._jobs.items())
+                if job.finished is not None and now - job.finished > self.ttl
+            ]
+        for job in expired:
+            if self.on_expire is not None and job.result is not None:
+                try:
+                    self.on_expire(job.result)
+                except Exception as e:
+                    print(f"failed to discard report job {job.job_id}: {e}")
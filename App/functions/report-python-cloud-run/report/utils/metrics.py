@@ -0,0 +1,187 @@
+"""Per-stage timing and resource metrics of report builds
+
+Code wraps the stages of a report build in ``stage(name)``. Each stage
+records its wall time, the bytes and chunks read from Zarr stores, the LLM
+tokens used, the size of the encoded figures and the peak RSS of the process. The numbers are added to the
+process-wide totals served on /metrics and, within ``trace_report()``, to
+the trace of the current request.
+
+Stages can be nested, fetches and tokens count towards the innermost one.
+"""
+import contextvars
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterator, Optional
+
+# add the trace of a request to the response as JSON in the X-Report-Metrics header
+REPORT_METRICS_HEADER = os.getenv("REPORT_METRICS_HEADER", "").lower() in ("1", "true", "yes")
+
+STAGES = ("catalog", "open", "slice", "content", "plot", "encode", "text", "overview", "html", "pdf")
+# upper bounds of the stage duration histogram, in seconds
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    seconds: float = 0.0
+    bytes_fetched: int = 0
+    chunks_read: int = 0
+    llm_tokens: int = 0
+    figure_bytes: int = 0
+    figure_bytes_saved: int = 0
+    peak_rss_bytes: int = 0
+
+    def add(self, other: "StageStats"):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.bytes_fetched += other.bytes_fetched
+        self.chunks_read += other.chunks_read
+        self.llm_tokens += other.llm_tokens
+        self.figure_bytes += other.figure_bytes
+        self.figure_bytes_saved += other.figure_bytes_saved
+        self.peak_rss_bytes = max(self.peak_rss_bytes, other.peak_rss_bytes)
+
+
+class Trace:
+    """Stage statistics of a single report request"""
+
+    def __init__(self):
+        self.stages: dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, stats: StageStats):
+        with self._lock:
+            self.stages.setdefault(stage, StageStats()).add(stats)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {stage: asdict(stats) for stage, stats in self.stages.items()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+
+class Metrics(Trace):
+    """Totals of all report builds in the process, with a histogram of the
+    stage durations"""
+
+    def __init__(self):
+        super().__init__()
+        self.buckets: dict[str, list[int]] = {}
+        self.collectors: list[Callable[[], list[str]]] = []
+
+    def register_collector(self, collector: Callable[[], list[str]]):
+        """Add the lines returned by collector to the rendered metrics"""
+        self.collectors.append(collector)
+
+    def observe(self, stage: str, stats: StageStats):
+        with self._lock:
+            self.stages.setdefault(stage, StageStats()).add(stats)
+            if stats.calls:
+                buckets = self.buckets.setdefault(stage, [0] * len(DURATION_BUCKETS))
+                for i, bound in enumerate(DURATION_BUCKETS):
+                    if stats.seconds <= bound:
+                        buckets[i] += 1
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            stages = {stage: StageStats(**asdict(stats)) for stage, stats in self.stages.items()}
+            buckets = {stage: list(counts) for stage, counts in self.buckets.items()}
+
+        lines = [
+            "# HELP gca_report_stage_seconds Wall time of report build stages",
+            "# TYPE gca_report_stage_seconds histogram",
+        ]
+        for stage, stats in stages.items():
+            for bound, count in zip(DURATION_BUCKETS, buckets.get(stage, [0] * len(DURATION_BUCKETS))):
+                lines.append(f'gca_report_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'gca_report_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.calls}')
+            lines.append(f'gca_report_stage_seconds_sum{{stage="{stage}"}} {stats.seconds}')
+            lines.append(f'gca_report_stage_seconds_count{{stage="{stage}"}} {stats.calls}')
+
+        counters = [
+            ("bytes_fetched", "gca_report_stage_bytes_fetched_total", "Bytes read from Zarr stores"),
+            ("chunks_read", "gca_report_stage_chunks_read_total", "Chunks read from Zarr stores"),
+            ("llm_tokens", "gca_report_stage_llm_tokens_total", "LLM tokens used"),
+            ("figure_bytes", "gca_report_stage_figure_bytes_total", "Bytes of the encoded figures"),
+            ("figure_bytes_saved", "gca_report_stage_figure_bytes_saved_total", "Bytes saved by the figure encoding, measured with FIGURE_MEASURE_SAVINGS"),
+        ]
+        for field, name, description in counters:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, stats in stages.items():
+                lines.append(f'{name}{{stage="{stage}"}} {getattr(stats, field)}')
+
+        lines.append("# HELP gca_process_peak_rss_bytes Peak resident set size of the process")
+        lines.append("# TYPE gca_process_peak_rss_bytes gauge")
+        lines.append(f"gca_process_peak_rss_bytes {peak_rss_bytes()}")
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("report_trace", default=None)
+_current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("report_stage", default=None)
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def record(stage: Optional[str] = None, **values):
+    """Add values (fields of StageStats) to stage, by default the current stage"""
+    stage = stage or _current_stage.get() or "other"
+    stats = StageStats(**values)
+    metrics.observe(stage, stats)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, stats)
+
+
+def record_fetch(nbytes: int, chunks: int = 1):
+    record(bytes_fetched=nbytes, chunks_read=chunks)
+
+
+def record_llm_tokens(tokens: int):
+    record(llm_tokens=tokens)
+
+
+def record_figure(nbytes: int, saved: int):
+    record(figure_bytes=nbytes, figure_bytes_saved=saved)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the code in the block as stage name"""
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_stage.reset(token)
+        record(name, calls=1, seconds=elapsed, peak_rss_bytes=peak_rss_bytes())
+
+
+@contextmanager
+def trace_report() -> Iterator[Trace]:
+    """Collect the stage statistics of the code in the block in a new trace"""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
@@ -0,0 +1,152 @@
+"""Section-parallel PDF layout
+
+WeasyPrint lays out a document on a single thread. With ``PDF_SECTION_WORKERS``
+set, the report html is split at the section markers of the template and each
+section is laid out as its own PDF in a pool of worker processes. The parts are
+merged with PyMuPDF: the page numbers are stamped on the merged pages, as every
+part counts its pages from 1, and the outlines of the parts are joined into the
+table of contents of the report.
+
+Every section starts on a new page in this mode.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Optional
+
+import fitz  # type: ignore
+import weasyprint
+
+from .concurrency import discard_process_pool
+from .render_context import get_render_context
+
+# 0 lays out the whole report in a single WeasyPrint document
+PDF_SECTION_WORKERS = int(os.getenv("PDF_SECTION_WORKERS", "0"))
+
+SECTION_MARKER = "<!-- report-section -->"
+# the parts leave out the page number of template.css, it is stamped after the merge
+PART_CSS = "@page { @bottom-right { content: none } }"
+
+# position of the stamped page number, matching @bottom-right of template.css:
+# 12px Arial, 14mm from the right edge, centred in the 75px bottom margin
+PAGE_NUMBER_FONTSIZE = 9
+PAGE_NUMBER_RIGHT = 14 * 72 / 25.4
+PAGE_NUMBER_BASELINE = 75 * 0.75 / 2 - PAGE_NUMBER_FONTSIZE / 3
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_part_stylesheet: Optional[weasyprint.CSS] = None
+
+
+def _warm_up():
+    """Initialise a layout worker: compile the templates, parse the
+    stylesheets and load the fonts before the first section is requested"""
+    global _part_stylesheet
+    render_context = get_render_context()
+    _part_stylesheet = weasyprint.CSS(string=PART_CSS, font_config=render_context.font_config)
+
+
+def _layout_part(html: str, base_url: Optional[str]) -> bytes:
+    return get_render_context().write_pdf(html, base_url=base_url, stylesheets=[_part_stylesheet])
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Get the shared layout pool, None when the report is laid out as a whole"""
+    global _pool
+    if PDF_SECTION_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_SECTION_WORKERS,
+                # forking a threaded web server is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+            )
+        return _pool
+
+
+def reset_pool(pool: ProcessPoolExecutor):
+    """Discard a broken layout pool, the next report starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    discard_process_pool(pool)
+
+
+def split_sections(html: str) -> list[str]:
+    """Split the report html into one document per section, the title and
+    stylesheet before the first section stay with the first one"""
+    head, *sections = html.split(SECTION_MARKER)
+    if not sections:
+        return [html]
+    return [head + sections[0], *sections[1:]]
+
+
+def merge_pdfs(parts: list[bytes]) -> bytes:
+    """Concatenate the part PDFs, number their pages and join their outlines
+
+    Args:
+        parts (list[bytes]): PDFs in report order
+
+    Returns:
+        bytes: merged PDF
+    """
+    merged = fitz.open()
+    toc = []
+    for part in parts:
+        with fitz.open(stream=part, filetype="pdf") as doc:
+            offset = merged.page_count
+            for level, title, page in doc.get_toc(simple=True):
+                # a part may start below the level the previous part ended on
+                level = min(level, toc[-1][0] + 1 if toc else 1)
+                toc.append([level, title, page + offset])
+            merged.insert_pdf(doc)
+
+    number_pages(merged)
+    merged.set_toc(toc)
+    return merged.tobytes(garbage=3, deflate=True)
+
+
+def number_pages(doc: fitz.Document):
+    """Write 'Page i of n' in the bottom right corner of every page"""
+    for i, page in enumerate(doc):
+        text = f"Page {i + 1} of {doc.page_count}"
+        width = fitz.get_text_length(text, fontname="helv", fontsize=PAGE_NUMBER_FONTSIZE)
+        page.insert_text(
+            (page.rect.width - PAGE_NUMBER_RIGHT - width, page.rect.height - PAGE_NUMBER_BASELINE),
+            text,
+            fontname="helv",
+            fontsize=PAGE_NUMBER_FONTSIZE,
+        )
+
+
+def write_report_pdf(html: str, target: IO[bytes], base_url: Optional[str] = None):
+    """Lay out the report html and write the PDF to target, section by section
+    in the layout pool when it is enabled. When a worker of the pool dies,
+    the report is laid out as a single document instead
+
+    Args:
+        html (str): report html, with images referenced by file URL as the
+            workers can't share the memory of the caller
+        target (IO[bytes]): file object the PDF is written to
+        base_url (str, optional): base of relative URLs in html
+    """
+    pool = get_pool()
+    parts = split_sections(html)
+    if pool is None or len(parts) == 1:
+        get_render_context().write_pdf(html, target, base_url=base_url)
+        return
+
+    try:
+        futures = [pool.submit(_layout_part, part, base_url) for part in parts]
+        pdfs = [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        print(f"layout pool is broken, laying out the report as a single document: {e}")
+        reset_pool(pool)
+        get_render_context().write_pdf(html, target, base_url=base_url)
+        return
+    target.write(merge_pdfs(pdfs))
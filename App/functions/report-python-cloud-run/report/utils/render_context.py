@@ -0,0 +1,67 @@
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence
+
+from jinja2 import Environment, FileSystemLoader, Template
+import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+
+TEMPLATE_DIR = Path(__file__).parent.parent
+
+# the stylesheet the templates inline for browsers, WeasyPrint gets the parsed one
+INLINE_CSS_PATTERN = re.compile(r'<style id="report-css">.*?</style>', re.DOTALL)
+
+
+@dataclass
+class RenderContext:
+    """Compiled templates and parsed stylesheet of the report, loaded once per
+    process and shared by all renders"""
+
+    report_template: Template
+    stream_template: Template
+    css: str
+    stylesheet: weasyprint.CSS
+    font_config: FontConfiguration
+
+    def write_pdf(
+        self,
+        html: str,
+        target=None,
+        base_url: Optional[str] = None,
+        stylesheets: Sequence[weasyprint.CSS] = (),
+    ) -> Optional[bytes]:
+        """Lay out html with the shared stylesheet and fonts and write the PDF
+        to target, or return it when target is None"""
+        html = INLINE_CSS_PATTERN.sub("", html)
+        return weasyprint.HTML(string=html, base_url=base_url).write_pdf(
+            target, stylesheets=[self.stylesheet, *stylesheets], font_config=self.font_config
+        )
+
+
+def load_render_context(template_dir: Path = TEMPLATE_DIR) -> RenderContext:
+    env = Environment(loader=FileSystemLoader(template_dir), auto_reload=False)
+    css = (template_dir / "template.css").read_text()
+    font_config = FontConfiguration()
+    return RenderContext(
+        report_template=env.get_template("template.html.jinja"),
+        stream_template=env.get_template("stream.html.jinja"),
+        css=css,
+        # resolve the url()s of the stylesheet, like the logos, next to it
+        stylesheet=weasyprint.CSS(string=css, base_url=str(template_dir), font_config=font_config),
+        font_config=font_config,
+    )
+
+
+_render_context: Optional[RenderContext] = None
+_render_context_lock = threading.Lock()
+
+
+def get_render_context() -> RenderContext:
+    """Get the render context of the process, loading it on first use"""
+    global _render_context
+    with _render_context_lock:
+        if _render_context is None:
+            _render_context = load_render_context()
+        return _render_context
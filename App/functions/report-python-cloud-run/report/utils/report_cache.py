@@ -0,0 +1,164 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import IO, Optional
+
+import shapely  # type: ignore
+
+REPORT_CACHE_DIR = os.getenv(
+    "REPORT_CACHE_DIR", str(Path(tempfile.gettempdir()) / "gca-report-cache")
+)
+REPORT_CACHE_MEMORY_BYTES = int(os.getenv("REPORT_CACHE_MEMORY_BYTES", str(256 * 2**20)))
+REPORT_CACHE_DISK_BYTES = int(os.getenv("REPORT_CACHE_DISK_BYTES", str(2 * 2**30)))
+
+# coordinates are rounded to ~10 cm, so polygons differing only by float noise share a key
+POLYGON_PRECISION = 1e-6
+
+
+def polygon_key(polygon: shapely.Polygon) -> str:
+    """Hash of the normalised WKB of polygon"""
+    normalised = shapely.normalize(shapely.set_precision(polygon, POLYGON_PRECISION))
+    return hashlib.sha256(shapely.to_wkb(normalised)).hexdigest()
+
+
+def content_key(*parts: str) -> str:
+    """Hash of a number of strings"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """Content-addressed cache for rendered reports
+
+    Results are kept in an in-memory LRU tier and a local disk tier, each
+    evicting least recently used entries once their size cap is reached.
+    A cap of 0 disables the tier.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = REPORT_CACHE_DIR,
+        max_memory_bytes: int = REPORT_CACHE_MEMORY_BYTES,
+        max_disk_bytes: int = REPORT_CACHE_DISK_BYTES,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir and max_disk_bytes > 0 else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            value = path.read_bytes()
+            # bump mtime, which is what the disk tier evicts on
+            path.touch()
+        except OSError:
+            return None
+        self._set_memory(key, value)
+        return value
+
+    def open(self, key: str) -> Optional[IO[bytes]]:
+        """Open cached value as a binary file, without reading a disk entry
+        into memory"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return BytesIO(self._memory[key])
+
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            file = path.open("rb")
+            path.touch()
+        except OSError:
+            return None
+        return file
+
+    def set_file(self, key: str, file: IO[bytes]):
+        """Store the contents of a binary file from its current position,
+        only the disk tier is used"""
+        path = self._path(key)
+        if path is None:
+            return
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as f:
+                shutil.copyfileobj(file, f)
+            tmp_path.replace(path)
+        except OSError as e:
+            print(f"failed to write report cache entry {path}: {e}")
+            return
+        self._evict_disk()
+
+    def set(self, key: str, value: bytes):
+        self._set_memory(key, value)
+
+        path = self._path(key)
+        if path is None:
+            return
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(value)
+            tmp_path.replace(path)
+        except OSError as e:
+            print(f"failed to write report cache entry {path}: {e}")
+            return
+        self._evict_disk()
+
+    def _path(self, key: str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / key
+
+    def _set_memory(self, key: str, value: bytes):
+        if len(value) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._memory[key] = value
+            self._memory_bytes += len(value)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+report_cache = ReportCache()
@@ -1,16 +1,59 @@
-from dataclasses import dataclass
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
 from pystac_client import Client
+import shapely  # type: ignore
+
+STAC_CACHE_TTL = float(os.getenv("STAC_CACHE_TTL", "3600"))
+STAC_CACHE_SNAPSHOT = os.getenv("STAC_CACHE_SNAPSHOT")
+# minimum seconds between two writes of the snapshot, the entries loaded in
+# between are written together
+STAC_CACHE_SNAPSHOT_INTERVAL = float(os.getenv("STAC_CACHE_SNAPSHOT_INTERVAL", "30"))
+
+# data asset field listing the pre-aggregated levels of a store, see
+# STAC/data/scripts/multiscales.py
+MULTISCALES_FIELD = "gca:multiscales"
 
 
 @dataclass
 class ZarrDataset:
     dataset_id: str
     zarr_uri: str
+    # multiscale levels as {"path": ..., "cell_size": ...}, relative to zarr_uri
+    multiscales: list[dict] = field(default_factory=list)
+
+
+@dataclass
+class ItemBBox:
+    item_id: str
+    bbox: list[float]
+    href: str
+
+
+class STACItemIndex:
+    """STRtree over the bounding boxes of the items in a collection"""
+
+    def __init__(self, items: list[ItemBBox]):
+        self.items = items
+        self.tree = shapely.STRtree([shapely.box(*item.bbox) for item in items])
+
+    def query(self, polygon: shapely.Polygon) -> list[ItemBBox]:
+        """Get the items whose bbox intersects polygon, in collection order"""
+        indices = self.tree.query(polygon, predicate="intersects")
+        return [self.items[i] for i in sorted(indices)]
 
 
 class STACClientGCA(Client):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._item_indexes: dict[str, tuple[list, STACItemIndex]] = {}
 
     def get_all_zarr_uris(self) -> list[ZarrDataset]:
         collections = self.get_collections()
@@ -23,6 +66,224 @@ class STACClientGCA(Client):
                     ZarrDataset(
                         dataset_id=collection.id,
                         zarr_uri=collection.assets["data"].href,
+                        multiscales=collection.assets["data"].extra_fields.get(MULTISCALES_FIELD, []),
                     )
                 )
         return zarr_datasets
+
+    def get_item_bboxes(self, collection_id: str, asset_key: str = "data") -> list[ItemBBox]:
+        """Get bbox and asset href of every item in a child collection"""
+        collection = self.get_child(collection_id)
+        return [
+            ItemBBox(item_id=item.id, bbox=list(item.bbox), href=item.assets[asset_key].href)
+            for item in collection.get_items()
+        ]
+
+    def query_items(
+        self, collection_id: str, polygon: shapely.Polygon, asset_key: str = "data"
+    ) -> list[ItemBBox]:
+        """Get the items of a child collection that intersect polygon
+
+        The item bboxes are resolved through the STAC cache and indexed once per
+        collection, so repeated queries don't touch the catalog.
+
+        Args:
+            collection_id (str): id of the child collection
+            polygon (Polygon): area of interest
+            asset_key (str): asset to return the href of
+
+        Returns:
+            list[ItemBBox]: intersecting items
+        """
+        key = f"item_bboxes|{self.get_self_href()}|{collection_id}|{asset_key}"
+        items = stac_cache.get(
+            key,
+            lambda: [asdict(i) for i in self.get_item_bboxes(collection_id, asset_key)],
+        )
+
+        # rebuild the index when the cache entry has been refreshed
+        cached = self._item_indexes.get(key)
+        if cached is None or cached[0] is not items:
+            cached = (items, STACItemIndex([ItemBBox(**i) for i in items]))
+            self._item_indexes[key] = cached
+
+        return cached[1].query(polygon)
+
+
+class STACCache:
+    """Process-wide cache for resolved STAC lookups
+
+    Entries older than ``ttl`` seconds are still served (stale-while-revalidate)
+    while a background thread reloads them. Values must be JSON serialisable so
+    they can be written to an optional on-disk snapshot, which is read back on
+    start-up to avoid a cold catalog walk. The snapshot is written at most
+    once every ``snapshot_interval`` seconds, and on exit.
+    """
+
+    def __init__(
+        self,
+        ttl: float = STAC_CACHE_TTL,
+        snapshot_path: Optional[str] = None,
+        snapshot_interval: float = STAC_CACHE_SNAPSHOT_INTERVAL,
+    ):
+        self.ttl = ttl
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.snapshot_interval = snapshot_interval
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self._last_snapshot = float("-inf")
+        self._snapshot_timer: Optional[threading.Timer] = None
+        self._load_snapshot()
+        if self.snapshot_path:
+            atexit.register(self.flush)
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """Get value for key, calling loader on a miss
+
+        Args:
+            key (str): cache key
+            loader (Callable): zero-argument callable resolving the value
+
+        Returns:
+            Any: cached or freshly loaded value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None:
+            value = loader()
+            self._set(key, value)
+            return value
+
+        stored_at, value = entry
+        if time.time() - stored_at > self.ttl:
+            self._refresh_in_background(key, loader)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+        self._schedule_snapshot()
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Any]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._set(key, loader())
+            except Exception as e:
+                # keep serving the stale value, we retry on the next request
+                print(f"failed to refresh STAC cache entry {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not self.snapshot_path.exists():
+            return
+        try:
+            snapshot = json.loads(self.snapshot_path.read_text())
+        except (OSError, ValueError) as e:
+            print(f"ignoring unreadable STAC cache snapshot {self.snapshot_path}: {e}")
+            return
+        self._entries = {
+            key: (stored_at, value) for key, (stored_at, value) in snapshot.items()
+        }
+
+    def flush(self):
+        """Write the entries of a pending snapshot now"""
+        with self._lock:
+            timer, self._snapshot_timer = self._snapshot_timer, None
+        if timer is not None:
+            timer.cancel()
+            self._write_snapshot()
+
+    def _schedule_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            if self._snapshot_timer is not None:
+                # the pending write picks up this entry
+                return
+            delay = self._last_snapshot + self.snapshot_interval - time.monotonic()
+            if delay > 0:
+                self._snapshot_timer = threading.Timer(delay, self._write_snapshot)
+                self._snapshot_timer.daemon = True
+                self._snapshot_timer.start()
+                return
+            self._last_snapshot = time.monotonic()
+        self._write_snapshot()
+
+    def _write_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            self._snapshot_timer = None
+            self._last_snapshot = time.monotonic()
+            snapshot = json.dumps(self._entries)
+        # unique per writer, a write in another thread or worker process
+        # sharing the snapshot must not replace it half written
+        tmp_path = self.snapshot_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(snapshot)
+            tmp_path.replace(self.snapshot_path)
+        except OSError as e:
+            print(f"failed to write STAC cache snapshot {self.snapshot_path}: {e}")
+
+
+stac_cache = STACCache(snapshot_path=STAC_CACHE_SNAPSHOT)
+
+_clients: dict[str, STACClientGCA] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(stac_root: str) -> STACClientGCA:
+    """Get an opened client for stac_root, shared across requests"""
+    with _clients_lock:
+        client = _clients.get(stac_root)
+    if client is None:
+        client = STACClientGCA.open(stac_root)
+        with _clients_lock:
+            client = _clients.setdefault(stac_root, client)
+    return client
+
+
+def get_zarr_datasets(stac_root: str) -> list[ZarrDataset]:
+    """Get all Zarr datasets in the catalog at stac_root, using the STAC cache"""
+    zarr_datasets = stac_cache.get(
+        f"zarr_datasets|{stac_root}",
+        lambda: [asdict(d) for d in get_client(stac_root).get_all_zarr_uris()],
+    )
+    return [ZarrDataset(**d) for d in zarr_datasets]
+
+
+def get_catalog_version(stac_root: str) -> str:
+    """Hash of the Zarr datasets in the catalog at stac_root. Changes whenever a
+    collection is added, removed or points to a new store"""
+    zarr_datasets = [asdict(d) for d in get_zarr_datasets(stac_root)]
+    return hashlib.sha256(json.dumps(zarr_datasets, sort_keys=True).encode()).hexdigest()
+
+
+def get_item_asset_href(
+    stac_root: str, collection_id: str, item_id: str, asset_key: str = "data"
+) -> str:
+    """Get the href of an item asset in a child collection of stac_root, using the STAC cache"""
+
+    def load() -> str:
+        collection = get_client(stac_root).get_child(collection_id)
+        return collection.get_item(item_id).assets[asset_key].href
+
+    return stac_cache.get(
+        f"item_href|{stac_root}|{collection_id}|{item_id}|{asset_key}", load
+    )
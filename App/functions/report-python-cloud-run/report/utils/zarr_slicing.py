@@ -1,7 +1,32 @@
+from collections import OrderedDict
 from enum import Enum
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import Optional
+import aiohttp
+import fsspec
 import shapely  # type: ignore
 import xarray as xr
 import numpy as np
+from zarr.storage import FSStore
+
+from .chunk_cache import ChunkCache, chunk_cache, chunk_key, chunk_namespace
+from .concurrency import ContextThreadPoolExecutor
+from .metrics import record_fetch
+
+ZARR_POOL_SIZE = int(os.getenv("ZARR_POOL_SIZE", "16"))
+HTTP_CONNECTION_LIMIT = int(os.getenv("HTTP_CONNECTION_LIMIT", "32"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+ZARR_READ_CONCURRENCY = int(os.getenv("ZARR_READ_CONCURRENCY", "16"))
+# width in pixels of the figures, multiscale levels with coarser cells are not used
+MULTISCALE_OUTPUT_PIXELS = int(os.getenv("MULTISCALE_OUTPUT_PIXELS", "1000"))
+STATION_INDEX_DIR = Path(
+    os.getenv("STATION_INDEX_DIR", Path(tempfile.gettempdir()) / "gca-station-index")
+)
+# encoding of pooled datasets holding the namespace of their store
+STORE_NAMESPACE = "store_namespace"
 
 
 class DatasetType(Enum):
@@ -9,6 +34,220 @@ class DatasetType(Enum):
     POINT = "point"
 
 
+async def _get_http_client(**kwargs) -> aiohttp.ClientSession:
+    """aiohttp session factory for fsspec with keep-alive and a connection limit"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT, keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector, **kwargs)
+
+
+def get_http_filesystem() -> fsspec.AbstractFileSystem:
+    """Get the HTTP filesystem shared by all Zarr stores. fsspec caches
+    filesystem instances, so every call returns the same session"""
+    return fsspec.filesystem("http", get_client=_get_http_client)
+
+
+# Shared by all slices, so ZARR_READ_CONCURRENCY bounds the concurrent chunk
+# reads of the process. Chunks are counted towards the report stage that loads them
+_read_pool = ContextThreadPoolExecutor(ZARR_READ_CONCURRENCY, thread_name_prefix="zarr-read")
+
+
+class CountingFSStore(FSStore):
+    """FSStore recording the number and size of the chunks read from it"""
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        record_fetch(len(value))
+        return value
+
+    def getitems(self, keys, **kwargs):
+        values = super().getitems(keys, **kwargs)
+        record_fetch(sum(len(value) for value in values.values()), len(values))
+        return values
+
+
+class CachingFSStore(CountingFSStore):
+    """CountingFSStore reading chunks through a local ChunkCache
+
+    Metadata is always read from the remote store. The chunks are cached under
+    a namespace derived from the consolidated metadata read when the store is
+    opened, so they are invalidated when the store is rewritten.
+    """
+
+    METADATA_KEYS = (".zmetadata", ".zgroup", ".zarray", ".zattrs")
+
+    def __init__(self, url: str, chunk_cache: ChunkCache, **kwargs):
+        super().__init__(url, **kwargs)
+        self.chunk_cache = chunk_cache
+        self.namespace = chunk_namespace(url, super().__getitem__(".zmetadata"))
+
+    def __getitem__(self, key):
+        if self._is_metadata(key):
+            return super().__getitem__(key)
+
+        cache_key = chunk_key(self.namespace, key)
+        value = self.chunk_cache.get(cache_key)
+        if value is None:
+            value = super().__getitem__(key)
+            self.chunk_cache.set(cache_key, value)
+        return value
+
+    def getitems(self, keys, **kwargs):
+        values = {}
+        missing = []
+        for key in keys:
+            value = None if self._is_metadata(key) else self.chunk_cache.get(chunk_key(self.namespace, key))
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+
+        if missing:
+            fetched = super().getitems(missing, **kwargs)
+            for key, value in fetched.items():
+                if not self._is_metadata(key):
+                    self.chunk_cache.set(chunk_key(self.namespace, key), value)
+            values.update(fetched)
+        return values
+
+    def _is_metadata(self, key: str) -> bool:
+        return key.rsplit("/", 1)[-1] in self.METADATA_KEYS
+
+
+class ZarrStorePool:
+    """Keyed pool of opened Zarr datasets with LRU eviction
+
+    Opened datasets keep their consolidated metadata and have their lat/lon
+    coordinates loaded, so repeated slices of a store don't go over HTTP for
+    either. The point coordinates are also cached on local disk per store
+    namespace, so a cold process reads them from there instead of the store.
+    """
+
+    def __init__(self, max_size: int = ZARR_POOL_SIZE):
+        self.max_size = max_size
+        self._datasets: OrderedDict[str, xr.Dataset] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> xr.Dataset:
+        with self._lock:
+            if url in self._datasets:
+                self._datasets.move_to_end(url)
+                return self._datasets[url]
+
+        dataset = self._open(url)
+
+        with self._lock:
+            # another thread may have opened the same store in the meantime
+            dataset = self._datasets.setdefault(url, dataset)
+            self._datasets.move_to_end(url)
+            while len(self._datasets) > self.max_size:
+                self._datasets.popitem(last=False)
+        return dataset
+
+    def clear(self):
+        with self._lock:
+            self._datasets.clear()
+
+    @staticmethod
+    def _open(url: str) -> xr.Dataset:
+        if url.startswith(("http://", "https://")) and chunk_cache.enabled:
+            store = CachingFSStore(url, chunk_cache, fs=get_http_filesystem(), mode="r")
+        elif url.startswith(("http://", "https://")):
+            store = CountingFSStore(url, fs=get_http_filesystem(), mode="r")
+        else:
+            store = CountingFSStore(url, mode="r")
+        dataset = xr.open_zarr(store)
+        namespace = getattr(store, "namespace", None) or store_namespace(url, store)
+
+        dataset = dataset.assign_coords(load_point_coords(dataset, namespace))
+        dataset.encoding[STORE_NAMESPACE] = namespace
+        return dataset
+
+
+def load_point_coords(dataset: xr.Dataset, namespace: str) -> dict[str, xr.Variable]:
+    """Load the lat/lon coordinates of a point dataset, raster dimension
+    coordinates already are
+
+    The coordinates are read from the disk cache of the store namespace if it
+    has them, and otherwise from the store, after which they are cached.
+
+    Returns:
+        dict[str, xr.Variable]: loaded coordinates, empty for raster datasets
+    """
+    names = [name for name in ("lat", "lon") if name in dataset.coords and name not in dataset.indexes]
+    if not names:
+        return {}
+
+    path = STATION_INDEX_DIR / f"{namespace}.npz"
+    if path.exists():
+        try:
+            with np.load(path) as cached:
+                if all(cached[name].shape == dataset[name].shape for name in names):
+                    return {
+                        name: xr.Variable(dataset[name].dims, cached[name], dataset[name].attrs)
+                        for name in names
+                    }
+            print(f"station coordinates {path} do not match the store, reading them again")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ignoring unreadable station coordinates {path}: {e}")
+
+    coords = {name: dataset[name].variable.load() for name in names}
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        np.savez(tmp_path, **{name: coords[name].values for name in names})
+        tmp_path.replace(path)
+    except OSError as e:
+        print(f"failed to write station coordinates {path}: {e}")
+    return coords
+
+
+def store_namespace(url: str, store) -> str:
+    """Namespace of the store at url, which changes when the store is rewritten"""
+    try:
+        zmetadata = store[".zmetadata"]
+    except KeyError:
+        # not consolidated, only the url identifies the store
+        zmetadata = b""
+    return chunk_namespace(url, zmetadata)
+
+
+zarr_store_pool = ZarrStorePool()
+
+
+class StationIndex:
+    """STRtree over the stations of a point dataset"""
+
+    def __init__(self, lons: np.ndarray, lats: np.ndarray):
+        self.tree = shapely.STRtree(shapely.points(lons, lats))
+
+    def query(self, polygon: shapely.Polygon) -> np.ndarray:
+        """Get the sorted integer positions of the stations within polygon"""
+        return np.sort(self.tree.query(polygon, predicate="contains"))
+
+
+_station_indexes: dict[str, StationIndex] = {}
+_station_indexes_lock = threading.Lock()
+
+
+def get_station_index(url: str, xarr: xr.Dataset) -> Optional[StationIndex]:
+    """Get the station index for the store at url, None for raster datasets"""
+    if ZarrSlicer._get_dataset_type(xarr) != DatasetType.POINT:
+        return None
+
+    # keyed like the store contents, so an index never outlives a rewrite of
+    # its store while the url stays the same
+    namespace = xarr.encoding.get(STORE_NAMESPACE) or chunk_namespace(url, b"")
+    with _station_indexes_lock:
+        station_index = _station_indexes.get(namespace)
+    if station_index is None:
+        station_index = StationIndex(xarr.coords["lon"].values, xarr.coords["lat"].values)
+        with _station_indexes_lock:
+            station_index = _station_indexes.setdefault(namespace, station_index)
+    return station_index
+
+
 class ZarrSlicer:
     @staticmethod
     def get_sliced_dataset(geojson_str: str, zarr_uri: str) -> xr.Dataset:
@@ -19,31 +258,101 @@ class ZarrSlicer:
             zarr_uri (str): String containing zarr uri
 
         Returns:
-            xr.Dataset: sliced lazy loaded zarr dataset
+            xr.Dataset: sliced zarr dataset, loaded into memory
         """
         polygon_shape = ZarrSlicer._create_shape_from_geojson(geojson_str)
         zarr = ZarrSlicer._get_dataset_from_zarr_url(zarr_uri)
-        sliced_zarr = ZarrSlicer.slice_xarr_with_polygon(zarr, polygon_shape)
+        station_index = get_station_index(zarr_uri, zarr)
+        sliced_zarr = ZarrSlicer.slice_xarr_with_polygon(zarr, polygon_shape, station_index)
         return sliced_zarr
 
+    @staticmethod
+    def get_multiscale_url(
+        zarr_uri: str,
+        multiscales: list[dict],
+        polygon: shapely.Polygon,
+        output_pixels: int = MULTISCALE_OUTPUT_PIXELS,
+    ) -> str:
+        """Get url of the coarsest multiscale level that still resolves the
+        polygon at output_pixels across
+
+        Args:
+            zarr_uri (str): url of the full resolution store
+            multiscales (list[dict]): levels of the store as advertised in STAC,
+                with their path relative to zarr_uri and cell size in degrees
+            polygon (Polygon): polygon the figures are drawn for
+            output_pixels (int, optional): width of the figures in pixels
+
+        Returns:
+            str: url of the level, zarr_uri if no level is coarse enough
+        """
+        minx, miny, maxx, maxy = polygon.bounds
+        pixel_size = max(maxx - minx, maxy - miny) / output_pixels
+        levels = [level for level in multiscales if level["cell_size"] <= pixel_size]
+        if not levels:
+            return zarr_uri
+        level = max(levels, key=lambda level: level["cell_size"])
+        return f"{zarr_uri.rstrip('/')}/{level['path']}"
+
     @staticmethod
     def slice_xarr_with_polygon(
-        xarr: xr.Dataset, polygon: shapely.Polygon
+        xarr: xr.Dataset,
+        polygon: shapely.Polygon,
+        station_index: Optional["StationIndex"] = None,
+        load: bool = True,
     ) -> xr.Dataset:
         """Slice xarray dataset with geojson polygon
 
         Args:
             xarr (xr.Dataset): xarray dataset
             polygon (Polygon): geojson polygon
+            station_index (StationIndex, optional): index of the stations of a point
+                dataset, used instead of testing every station against the polygon
+            load (bool, optional): load the slice into memory, reading its chunks
+                concurrently, so later consumers don't read them again
 
         Returns:
             xr.Dataset: sliced xarray dataset
         """
+        sliced_xarr = ZarrSlicer._slice(xarr, polygon, station_index)
+        if load:
+            return ZarrSlicer.load(sliced_xarr)
+        return sliced_xarr
+
+    @staticmethod
+    def load(xarr: xr.Dataset) -> xr.Dataset:
+        """Load all variables of a lazy dataset in a single dask computation
+
+        The chunks of all variables are read concurrently on the read pool,
+        rather than one by one whenever a consumer accesses ``.values``.
+
+        Args:
+            xarr (xr.Dataset): lazy xarray dataset
+
+        Returns:
+            xr.Dataset: xarray dataset backed by numpy arrays
+        """
+        # compute rather than load, which would also load the variables the
+        # slice shares with the pooled dataset in place; the scheduler is
+        # passed per call, as dask's config is global to all report threads
+        return xarr.compute(scheduler="threads", pool=_read_pool)
+
+    @staticmethod
+    def _slice(
+        xarr: xr.Dataset,
+        polygon: shapely.Polygon,
+        station_index: Optional["StationIndex"] = None,
+    ) -> xr.Dataset:
+        """Lazily slice xarray dataset with polygon"""
         dataset_type = ZarrSlicer._get_dataset_type(xarr)
 
         if dataset_type == DatasetType.RASTER:
             spatial_dims = ZarrSlicer._get_spatial_dimensions(xarr)
-            indexer = ZarrSlicer._get_indexer_from_raster(xarr, polygon, spatial_dims)
+            indexer, mask = ZarrSlicer._get_indexer_from_raster(xarr, polygon, spatial_dims)
+            return ZarrSlicer._mask_raster(xarr.isel(indexer), mask)
+        elif dataset_type == DatasetType.POINT and station_index is not None:
+            spatial_dims = ZarrSlicer._get_spatial_dimensions(xarr)
+            return xarr.isel({spatial_dims[0]: station_index.query(polygon)})
         elif dataset_type == DatasetType.POINT:
             points = ZarrSlicer._create_points_from_xarr(xarr)
             boolean_mask = ZarrSlicer._get_boolean_mask_from_points(points, polygon)
@@ -89,9 +398,9 @@ class ZarrSlicer:
 
     @staticmethod
     def _get_spatial_dimensions(xarr: xr.Dataset) -> list[str]:
-        """Get spatial dimension from xarray dataset"""
-        dims = {xarr.lat.dims[0], xarr.lon.dims[0]}
-        return list(dims)
+        """Get spatial dimensions from xarray dataset, the dimension of lat
+        followed by that of lon unless they share one"""
+        return list(dict.fromkeys([xarr.lat.dims[0], xarr.lon.dims[0]]))
 
     @staticmethod
     def _get_boolean_mask_from_points(
@@ -103,25 +412,72 @@ class ZarrSlicer:
     @staticmethod
     def _get_indexer_from_raster(
         raster: xr.Dataset, polygon: shapely.Polygon, spatial_dims: list[str]
-    ) -> [bool]:
-        """Get boolean mask from raster and polygon"""
-        spatial_dim_size = {dim: len(raster[dim].values) for dim in spatial_dims}
+    ) -> tuple[dict[str, slice], xr.DataArray]:
+        """Get window indexer and cell mask from raster and polygon
 
-        coords = np.stack(
-            np.meshgrid(raster[spatial_dims[1]].values, raster[spatial_dims[0]].values),
-            -1,
-        ).reshape(
-            spatial_dim_size[spatial_dims[0]], spatial_dim_size[spatial_dims[1]], 2
-        )
+        Only the cells within the polygon bounds are tested, so the cost scales
+        with the size of the polygon rather than the size of the raster.
 
-        raster_points = shapely.points(coords)
+        Args:
+            raster (xr.Dataset): raster dataset with 1D lat and lon coordinates
+            polygon (Polygon): polygon to select the cells of
+            spatial_dims (list[str]): dimensions of lat and lon, in that order
 
-        mask = shapely.within(raster_points, polygon)
+        Returns:
+            tuple[dict[str, slice], xr.DataArray]: positional indexer of the smallest
+                window containing all cells within the polygon, and the boolean
+                mask of those cells within the window
+        """
+        lat_dim, lon_dim = spatial_dims
+        lons = raster["lon"].values
+        lats = raster["lat"].values
+        minx, miny, maxx, maxy = polygon.bounds
+
+        # Coordinates are monotonic, so the candidates form a contiguous window
+        lon_window = ZarrSlicer._get_window((lons >= minx) & (lons <= maxx))
+        lat_window = ZarrSlicer._get_window((lats >= miny) & (lats <= maxy))
+
+        window_lons, window_lats = np.meshgrid(lons[lon_window], lats[lat_window])
+        mask = shapely.contains_xy(polygon, window_lons, window_lats)
+
+        # Shrink window to the cells that are actually inside the polygon
+        lat_inner = ZarrSlicer._get_window(mask.any(axis=1))
+        lon_inner = ZarrSlicer._get_window(mask.any(axis=0))
+        mask = mask[lat_inner, lon_inner]
+
+        indexer = {
+            lat_dim: slice(lat_window.start + lat_inner.start, lat_window.start + lat_inner.stop),
+            lon_dim: slice(lon_window.start + lon_inner.start, lon_window.start + lon_inner.stop),
+        }
+        return indexer, xr.DataArray(mask, dims=(lat_dim, lon_dim))
 
-        # Reduce mask to square shape
-        # TODO: create point wise indexing for DataSet;
-        indexer = {"lat": mask.any(axis=1), "lon": mask.any(axis=0)}
-        return indexer
+    @staticmethod
+    def _get_window(candidates: np.ndarray) -> slice:
+        """Get slice spanning the True values of a 1D boolean array"""
+        indices = np.flatnonzero(candidates)
+        if len(indices) == 0:
+            return slice(0, 0)
+        return slice(indices[0], indices[-1] + 1)
+
+    @staticmethod
+    def _mask_raster(xarr: xr.Dataset, mask: xr.DataArray) -> xr.Dataset:
+        """Mask cells outside the polygon in the spatial variables of xarr
+
+        Integer variables with a ``_FillValue`` keep their dtype and are
+        filled with it, so class rasters keep their codes. Other variables,
+        including integer variables without a fill value, are masked with NaN
+        and so become floats.
+        """
+        masked_vars = {}
+        for name, var in xarr.data_vars.items():
+            if not set(mask.dims) <= set(var.dims):
+                continue
+            fill_value = var.encoding.get("_FillValue", var.attrs.get("_FillValue"))
+            if np.issubdtype(var.dtype, np.integer) and fill_value is not None:
+                masked_vars[name] = var.where(mask, np.asarray(fill_value, dtype=var.dtype))
+            else:
+                masked_vars[name] = var.where(mask)
+        return xarr.assign(masked_vars)
 
     @staticmethod
     def _create_shape_from_geojson(geojson: str) -> shapely.Polygon:
@@ -130,5 +486,5 @@ class ZarrSlicer:
 
     @staticmethod
     def _get_dataset_from_zarr_url(url: str) -> xr.Dataset:
-        """Get zarr store from url"""
-        return xr.open_zarr(url)
+        """Get zarr store from url, reusing opened stores from the pool"""
+        return zarr_store_pool.get(url)
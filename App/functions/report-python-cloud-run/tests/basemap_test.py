@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def test_tile_coordinates_round_trip():
+    from report.datasets.basemap import lonlat_to_tile, tile_to_lonlat
+
+    x, y = lonlat_to_tile(5.07, 53.36, 10)
+    lon, lat = tile_to_lonlat(x, y, 10)
+
+    assert np.isclose(lon, 5.07)
+    assert np.isclose(lat, 53.36)
+
+
+def test_offline_tile_cache_does_not_fetch(tmp_path):
+    from report.datasets.basemap import TileCache
+
+    cache = TileCache("CartoDB.Positron", cache_dir=tmp_path, offline=True)
+
+    assert cache.get_tile(3, 4, 2) is None
+
+
+def test_inset_width_is_its_own():
+    from matplotlib.figure import Figure
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+    from report.datasets.basemap import get_width_px
+
+    fig = Figure(figsize=(20, 16))
+    ax = fig.subplots(1, 2)
+    worldax = inset_axes(ax[0], width=2.5, height=2, loc="upper left")
+
+    assert np.isclose(get_width_px(worldax), 2.5 * fig.dpi)
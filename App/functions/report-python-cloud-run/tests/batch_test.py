@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+
+def square(x: float) -> dict:
+    return {"type": "Polygon", "coordinates": [[[x, 0], [x + 1, 0], [x + 1, 1], [x, 1], [x, 0]]]}
+
+
+def test_read_aois_names_areas(tmp_path):
+    from report.batch import read_aois
+
+    path = tmp_path / "aois.geojson"
+    features = [
+        {"type": "Feature", "properties": {"name": "Rhine delta"}, "geometry": square(0)},
+        {"type": "Feature", "id": 7, "geometry": square(1)},
+        {"type": "Feature", "geometry": square(2)},
+    ]
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+
+    assert [aoi.name for aoi in read_aois(path)] == ["Rhine_delta", "7", "aoi-2"]
+
+    # one geometry per line
+    path.write_text("\n".join(json.dumps(square(x)) for x in range(2)))
+    assert [aoi.polygon.bounds[0] for aoi in read_aois(path)] == [0, 1]
+
+
+def test_read_aois_rejects_other_geometries(tmp_path):
+    from report.batch import read_aois
+
+    path = tmp_path / "aois.geojson"
+    path.write_text(json.dumps({"type": "Point", "coordinates": [0, 0]}))
+
+    with pytest.raises(ValueError, match="expected a Polygon"):
+        read_aois(path)
+
+
+def test_rerun_skips_built_areas(tmp_path):
+    from shapely.geometry import shape
+    from report.batch import AOI, PROGRESS_FILE, is_built, load_progress
+    from report.utils.report_cache import polygon_key
+
+    aoi = AOI(name="a", polygon=shape(square(0)))
+    (tmp_path / "a.html").write_text("")
+    (tmp_path / "a.pdf").write_bytes(b"")
+    records = [
+        {"name": "a", "polygon_key": polygon_key(aoi.polygon), "status": "failed"},
+        {"name": "a", "polygon_key": polygon_key(aoi.polygon), "status": "done"},
+    ]
+    # the last line of an interrupted run is cut off
+    (tmp_path / PROGRESS_FILE).write_text("".join(json.dumps(r) + "\n" for r in records) + '{"name": "b"')
+
+    progress = load_progress(tmp_path)
+    assert progress.keys() == {"a"}
+    assert is_built(aoi, progress["a"], tmp_path)
+
+    # the area changed since it was built
+    assert not is_built(AOI(name="a", polygon=shape(square(1))), progress["a"], tmp_path)
+    (tmp_path / "a.pdf").unlink()
+    assert not is_built(aoi, progress["a"], tmp_path)
@@ -0,0 +1,43 @@
+import numpy as np
+import xarray as xr
+
+
+def test_chunk_cache_evicts_least_recently_used(tmp_path):
+    from report.utils.chunk_cache import ChunkCache
+
+    cache = ChunkCache(cache_dir=str(tmp_path), max_bytes=10)
+    cache.set("aa", b"1234")
+    cache.set("bb", b"1234")
+    assert cache.get("aa") == b"1234"
+    cache.set("cc", b"1234")
+
+    # bb was used least recently
+    assert cache.get("bb") is None
+    assert cache.get("aa") == b"1234"
+    assert cache.get("cc") == b"1234"
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["bytes"] == 8
+
+    # the index is rebuilt from disk by a new process
+    assert ChunkCache(cache_dir=str(tmp_path), max_bytes=10).get("cc") == b"1234"
+
+
+def test_caching_store_is_invalidated_by_new_metadata(tmp_path):
+    from report.utils.chunk_cache import ChunkCache
+    from report.utils.zarr_slicing import CachingFSStore
+
+    path = tmp_path / "store.zarr"
+    xr.Dataset({"value": ("x", np.arange(4.0))}).to_zarr(path, consolidated=True)
+    cache = ChunkCache(cache_dir=str(tmp_path / "cache"), max_bytes=2**20)
+
+    first = CachingFSStore(str(path), cache, mode="r")["value/0"]
+    assert CachingFSStore(str(path), cache, mode="r")["value/0"] == first
+    assert cache.stats()["hits"] == 1
+
+    xr.Dataset({"value": ("x", np.arange(4.0) + 1), "other": ("x", np.zeros(4))}).to_zarr(
+        path, mode="w", consolidated=True
+    )
+    # the rewritten store has new metadata, so its chunks are read again
+    assert CachingFSStore(str(path), cache, mode="r")["value/0"] != first
+    assert cache.stats()["misses"] == 2
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+
+def test_single_flight_shares_result_of_concurrent_calls():
+    from report.utils.concurrency import SingleFlight
+
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def build():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "report"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", build)))
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(target=lambda: results.append(flight.do("key", build)))
+        for _ in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    # give the followers time to join the call in flight
+    threading.Event().wait(0.1)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert calls == [1]
+    assert sorted(results) == [("report", False)] + [("report", True)] * 3
+    # once finished the key runs again
+    assert flight.do("key", lambda: "again") == ("again", False)
+
+
+def test_single_flight_propagates_errors():
+    from report.utils.concurrency import SingleFlight
+
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 1) == (1, False)
+
+
+def test_iter_concurrently_yields_results_as_they_finish():
+    from report.utils.concurrency import iter_concurrently
+
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "slow"
+
+    def fast():
+        return "fast"
+
+    results = iter_concurrently({"slow": slow, "fast": fast})
+    # the fast task is yielded while the slow one is still running
+    assert next(results) == ("fast", "fast")
+    release.set()
+    assert list(results) == [("slow", "slow")]
+
+
+def test_iter_concurrently_skips_tasks_after_timeout():
+    from report.utils.concurrency import iter_concurrently
+
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+
+    results = list(iter_concurrently({"slow": slow, "fast": lambda: 1}, timeout=0.1))
+    release.set()
+
+    assert results == [("fast", 1)]
+
+
+def test_tasks_are_timed_from_when_they_start():
+    from report.utils.concurrency import run_concurrently
+
+    def task():
+        time.sleep(0.2)
+        return 1
+
+    # the second task waits for the first, together they take longer than the timeout
+    assert run_concurrently({"a": task, "b": task}, max_workers=1, timeout=0.3) == {"a": 1, "b": 1}
+
+
+def test_queued_tasks_are_skipped_when_workers_hold_timed_out_tasks():
+    from report.utils.concurrency import iter_concurrently
+
+    release = threading.Event()
+
+    def hung():
+        release.wait(5)
+
+    start = time.monotonic()
+    results = list(iter_concurrently({"hung": hung, "queued": lambda: 1}, max_workers=1, timeout=0.1))
+    release.set()
+
+    assert results == []
+    assert time.monotonic() - start < 1
+
+
+def test_iter_concurrently_skips_failed_tasks():
+    from report.utils.concurrency import iter_concurrently
+
+    def fail():
+        raise ValueError("dataset unavailable")
+
+    results = list(iter_concurrently({"fail": fail, "ok": lambda: 1}))
+
+    assert results == [("ok", 1)]
+
+
+def test_single_flight_can_be_led_without_a_function():
+    from report.utils.concurrency import SingleFlight
+
+    flight = SingleFlight()
+    future, leader = flight.start("key")
+    assert leader
+
+    waiter = threading.Thread(target=lambda: results.append(flight.do("key", lambda: "other")))
+    results = []
+    waiter.start()
+    time.sleep(0.2)
+    future.set_result("streamed")
+    flight.end("key")
+    waiter.join(5)
+
+    assert results == [("streamed", True)]
+    assert flight.start("key")[1]
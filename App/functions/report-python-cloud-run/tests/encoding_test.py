@@ -0,0 +1,63 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+def categorical_png() -> bytes:
+    rng = np.random.default_rng(0)
+    colors = np.array([[255, 255, 0, 255], [165, 42, 42, 255], [0, 0, 255, 255], [0, 128, 0, 255]], dtype="uint8")
+    pixels = colors[rng.integers(0, len(colors), size=(200, 300))]
+    png = BytesIO()
+    Image.fromarray(pixels, "RGBA").save(png, format="png")
+    return png.getvalue()
+
+
+def test_categorical_figures_are_quantised():
+    from report.datasets.encoding import compress_image
+
+    png = categorical_png()
+    image_format, data = compress_image(png, "categorical")
+
+    assert image_format == "png"
+    assert len(data) < len(png)
+    assert Image.open(BytesIO(data)).mode == "P"
+
+
+def test_plots_stay_lossless():
+    from report.datasets.encoding import compress_image
+
+    png = categorical_png()
+
+    assert compress_image(png, "plot") == ("png", png)
+
+
+def test_asset_store_is_referenced_by_url(tmp_path, monkeypatch):
+    from report.datasets import encoding
+
+    monkeypatch.setattr(encoding, "FIGURE_ASSET_DIR", str(tmp_path))
+    src = encoding.image_src(b"figure", "png")
+
+    assert src.startswith(encoding.FIGURE_ASSET_URL)
+    assert (tmp_path / src.removeprefix(encoding.FIGURE_ASSET_URL)).read_bytes() == b"figure"
+    html = encoding.resolve_asset_urls(f'<img src="{src}" />')
+    assert html == f'<img src="{(tmp_path / src.removeprefix(encoding.FIGURE_ASSET_URL)).resolve().as_uri()}" />'
+
+
+def test_asset_store_evicts_least_recently_used(tmp_path, monkeypatch):
+    import os
+    from report.datasets import encoding
+
+    monkeypatch.setattr(encoding, "FIGURE_ASSET_DIR", str(tmp_path))
+    monkeypatch.setattr(encoding, "FIGURE_ASSET_MAX_BYTES", 20)
+    first = encoding.image_src(b"0" * 10, "png")
+    second = encoding.image_src(b"1" * 10, "png")
+    for i, src in enumerate([first, second]):
+        os.utime(tmp_path / src.removeprefix(encoding.FIGURE_ASSET_URL), (i, i))
+
+    # a cached report using the first figure keeps it
+    assert encoding.touch_assets(f'<img src="{first}" />')
+    encoding.image_src(b"2" * 10, "png")
+
+    assert encoding.touch_assets(f'<img src="{first}" />')
+    assert not encoding.touch_assets(f'<img src="{second}" />')
@@ -0,0 +1,95 @@
+def test_identical_prompts_are_sent_once(tmp_path, monkeypatch):
+    from report.utils import gentext
+
+    calls = []
+
+    class CountingBackend(gentext.StubChatBackend):
+        def complete(self, prompt: str) -> str:
+            calls.append(prompt)
+            return super().complete(prompt)
+
+    monkeypatch.setattr(gentext, "llm_backend", CountingBackend())
+    monkeypatch.setattr(
+        gentext, "llm_cache", gentext.SQLiteLLMCache(str(tmp_path / "llm.sqlite"))
+    )
+
+    first = gentext.complete("describe the coast")
+    second = gentext.complete("describe the coast")
+    gentext.complete("describe another coast")
+
+    assert first == second
+    assert calls == ["describe the coast", "describe another coast"]
+
+
+def test_sqlite_llm_cache_expires(tmp_path):
+    from report.utils.gentext import SQLiteLLMCache
+
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite"), ttl=-1)
+    cache.set("key", "response")
+
+    assert cache.get("key") is None
+
+
+def test_describe_report_fills_section_texts_before_overview(monkeypatch):
+    import shapely
+    from report.datasets.datasetcontent import DatasetContent
+    from report.utils import gentext
+
+    prompts = []
+
+    class RecordingBackend(gentext.StubChatBackend):
+        async def acomplete(self, prompt: str, client: None) -> str:
+            prompts.append(prompt)
+            return f"text for {prompt[:8]}"
+
+    monkeypatch.setattr(gentext, "llm_backend", RecordingBackend())
+    monkeypatch.setattr(gentext, "llm_cache", gentext.MemoryLLMCache())
+
+    contents = [
+        DatasetContent(dataset_id="a", title="A", text="", prompt="prompt a"),
+        DatasetContent(dataset_id="b", title="B", text="", prompt="prompt b"),
+        DatasetContent(dataset_id="c", title="C", text="no prompt"),
+    ]
+    overview_text = gentext.describe_report(shapely.box(0, 0, 1, 1), contents)
+
+    assert [c.text for c in contents] == ["text for prompt a", "text for prompt b", "no prompt"]
+    # the overview prompt is sent last and includes the section texts
+    assert sorted(prompts[:2]) == ["prompt a", "prompt b"]
+    assert "text for prompt a" in prompts[2]
+    assert overview_text == f"text for {prompts[2][:8]}"
+
+
+def test_rate_limiter_is_shared_across_threads_and_event_loops():
+    import asyncio
+    import threading
+    import time
+    from report.utils.gentext import RateLimiter
+
+    limiter = RateLimiter(max_concurrency=2, requests_per_second=0)
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    async def request():
+        nonlocal running, peak
+        async with limiter:
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            with lock:
+                running -= 1
+
+    async def section():
+        await asyncio.gather(*(request() for _ in range(3)))
+
+    # every streamed section describes its texts in its own event loop
+    threads = [threading.Thread(target=asyncio.run, args=(section(),)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    with limiter:
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    assert peak <= 2
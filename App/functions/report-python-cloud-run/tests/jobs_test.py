@@ -0,0 +1,64 @@
+import threading
+
+
+def test_job_queue_deduplicates_in_flight_jobs():
+    from report.utils.jobs import JobQueue, JobStatus
+
+    release = threading.Event()
+    calls = []
+
+    def run(argument):
+        calls.append(argument)
+        release.wait(5)
+        return argument * 2
+
+    queue = JobQueue(run, max_workers=2)
+    first = queue.submit("key", 21)
+    second = queue.submit("key", 21)
+    assert first is second
+
+    release.set()
+    for _ in range(100):
+        if first.status == JobStatus.DONE:
+            break
+        threading.Event().wait(0.01)
+
+    assert first.result == 42
+    assert calls == [21]
+    # a finished job is no longer in flight, so the key can run again
+    assert queue.submit("key", 21) is not first
+
+
+def test_job_queue_records_failures():
+    from report.utils.jobs import JobQueue, JobStatus
+
+    def run(argument):
+        raise ValueError("no data")
+
+    queue = JobQueue(run, max_workers=1)
+    job = queue.submit("key", None)
+    for _ in range(100):
+        if job.finished is not None:
+            break
+        threading.Event().wait(0.01)
+
+    assert job.status == JobStatus.FAILED
+    assert job.error == "no data"
+
+
+def test_job_queue_expires_finished_jobs():
+    from report.utils.jobs import JobQueue
+
+    discarded = []
+    queue = JobQueue(lambda argument: argument, max_workers=1, ttl=0, on_expire=discarded.append)
+    job = queue.submit("key", "result")
+    for _ in range(100):
+        if job.finished is not None:
+            break
+        threading.Event().wait(0.01)
+    threading.Event().wait(0.01)
+
+    queue.expire()
+    assert queue.get(job.job_id) is None
+    assert discarded == ["result"]
+    queue.close()
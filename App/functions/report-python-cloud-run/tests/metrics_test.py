@@ -0,0 +1,43 @@
+import json
+import threading
+
+
+def test_stages_are_recorded_in_trace_and_totals(monkeypatch):
+    from report.utils.metrics import Metrics, record_fetch, stage, trace_report
+    from report.utils import metrics as metrics_module
+
+    monkeypatch.setattr(metrics_module, "metrics", Metrics())
+    with trace_report() as trace:
+        with stage("slice"):
+            record_fetch(100)
+            record_fetch(50)
+            with stage("plot"):
+                record_fetch(10)
+
+    stages = json.loads(trace.to_json())
+    assert stages["slice"]["calls"] == 1
+    assert stages["slice"]["bytes_fetched"] == 150
+    assert stages["slice"]["chunks_read"] == 2
+    # fetches count towards the innermost stage
+    assert stages["plot"]["bytes_fetched"] == 10
+    assert stages["slice"]["peak_rss_bytes"] > 0
+
+    exposition = metrics_module.metrics.render()
+    assert 'gca_report_stage_seconds_count{stage="slice"} 1' in exposition
+    assert 'gca_report_stage_bytes_fetched_total{stage="slice"} 150' in exposition
+
+
+def test_concurrent_tasks_are_traced_as_part_of_the_request():
+    from report.utils.concurrency import run_concurrently
+    from report.utils.metrics import record_llm_tokens, stage, trace_report
+
+    def task():
+        with stage("text"):
+            record_llm_tokens(42)
+        return threading.current_thread().name
+
+    with trace_report() as trace:
+        results = run_concurrently({"a": task, "b": task})
+
+    assert all(name.startswith("report") for name in results.values())
+    assert trace.to_dict()["text"]["llm_tokens"] == 84
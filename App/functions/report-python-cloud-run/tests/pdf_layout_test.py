@@ -0,0 +1,37 @@
+def test_split_sections_keeps_head_with_first_section():
+    from report.utils.pdf_layout import SECTION_MARKER, split_sections
+
+    html = f"<style></style><h1>Title</h1>{SECTION_MARKER}<p>a</p>{SECTION_MARKER}<p>b</p>"
+
+    assert split_sections(html) == ["<style></style><h1>Title</h1><p>a</p>", "<p>b</p>"]
+    assert split_sections("<p>no sections</p>") == ["<p>no sections</p>"]
+
+
+def test_merge_pdfs_numbers_pages_and_joins_toc():
+    import fitz
+    from report.utils.pdf_layout import merge_pdfs
+
+    def part(pages: int, toc: list) -> bytes:
+        doc = fitz.open()
+        for _ in range(pages):
+            doc.new_page()
+        doc.set_toc(toc)
+        return doc.tobytes()
+
+    merged = merge_pdfs(
+        [
+            part(2, [[1, "Title", 1], [2, "Overview", 2]]),
+            part(1, [[1, "Population", 1]]),
+            part(2, [[1, "Shoreline change", 2]]),
+        ]
+    )
+
+    with fitz.open(stream=merged, filetype="pdf") as doc:
+        assert doc.page_count == 5
+        assert "Page 3 of 5" in doc[2].get_text()
+        assert doc.get_toc(simple=True) == [
+            [1, "Title", 1],
+            [2, "Overview", 2],
+            [1, "Population", 3],
+            [1, "Shoreline change", 5],
+        ]
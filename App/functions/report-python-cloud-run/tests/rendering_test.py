@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def crash_in_worker() -> str:
+    if multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return "figure"
+
+
+def test_broken_pool_falls_back_to_rendering_in_process(monkeypatch):
+    from report.datasets import rendering
+
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    monkeypatch.setattr(rendering, "PLOT_WORKERS", 1)
+    monkeypatch.setattr(rendering, "_pool", pool)
+
+    assert rendering.render_plot(crash_in_worker) == "figure"
+    # the next figure gets a new pool
+    assert rendering._pool is None
@@ -0,0 +1,38 @@
+import shapely
+
+
+def test_polygon_key_ignores_orientation_and_float_noise():
+    from report.utils.report_cache import polygon_key
+
+    polygon = shapely.Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    reversed_noisy = shapely.Polygon([(0, 1 + 1e-9), (1, 1), (1, 0), (0, 0)])
+
+    assert polygon_key(polygon) == polygon_key(reversed_noisy)
+    assert polygon_key(polygon) != polygon_key(shapely.box(0, 0, 2, 2))
+
+
+def test_report_cache_evicts_least_recently_used(tmp_path):
+    from report.utils.report_cache import ReportCache
+
+    cache = ReportCache(cache_dir=str(tmp_path), max_memory_bytes=10, max_disk_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.set("c", b"cccc")
+
+    # b was used least recently, so it is evicted from memory
+    assert "b" not in cache._memory
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+
+
+def test_report_cache_streams_disk_entries(tmp_path):
+    from io import BytesIO
+    from report.utils.report_cache import ReportCache
+
+    cache = ReportCache(cache_dir=str(tmp_path), max_memory_bytes=0)
+    cache.set_file("pdf", BytesIO(b"%PDF-1.7"))
+
+    with cache.open("pdf") as f:
+        assert f.read() == b"%PDF-1.7"
+    assert cache.open("missing") is None
@@ -0,0 +1,28 @@
+import numpy as np
+import xarray as xr
+
+
+def test_change_classes_do_not_depend_on_multiscale_level(monkeypatch):
+    from report.datasets import shoremon
+
+    rng = np.random.default_rng(0)
+    n = 1000
+    full = xr.Dataset(
+        {"changerate": ("stations", rng.normal(0, 3, n))},
+        coords={"lon": ("stations", rng.uniform(4, 6, n)), "lat": ("stations", rng.uniform(52, 54, n))},
+    )
+    # a coarse level with the mean change rate of 10 transects per cell
+    level = full.coarsen(stations=10).mean()
+    level["count"] = ("stations", np.full(level.sizes["stations"], 10))
+
+    plotted = []
+    monkeypatch.setattr(shoremon, "render_plot", lambda func, *args: plotted.append(args) or "")
+    monkeypatch.setattr(shoremon, "make_prompt", lambda xarr, dataset_id: "")
+
+    shoremon.get_shoremon_content(full)
+    shoremon.get_shoremon_content(full, level)
+
+    (full_xarr, full_counts), (level_xarr, level_counts) = plotted
+    assert level_xarr is level
+    np.testing.assert_array_equal(full_counts, level_counts)
+    np.testing.assert_array_equal(full_counts, np.histogram(full["changerate"], bins=shoremon.CHANGE_BINS)[0])
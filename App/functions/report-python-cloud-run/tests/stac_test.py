@@ -0,0 +1,84 @@
+import json
+import time
+
+
+def test_stac_cache_serves_stale_value_while_refreshing():
+    from report.utils.stac import STACCache
+
+    cache = STACCache(ttl=0)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get("key", loader) == 1
+    # expired entry is returned straight away and reloaded in the background
+    assert cache.get("key", loader) == 1
+
+    for _ in range(50):
+        if len(calls) == 2:
+            break
+        time.sleep(0.01)
+    assert len(calls) == 2
+
+
+def test_stac_cache_snapshot(tmp_path):
+    from report.utils.stac import STACCache
+
+    snapshot_path = tmp_path / "stac_cache.json"
+    cache = STACCache(ttl=3600, snapshot_path=str(snapshot_path))
+    cache.get("key", lambda: ["value"])
+
+    cold_cache = STACCache(ttl=3600, snapshot_path=str(snapshot_path))
+    assert cold_cache.get("key", lambda: ["other"]) == ["value"]
+
+
+def test_stac_cache_snapshot_writes_are_batched(tmp_path):
+    from report.utils.stac import STACCache
+
+    snapshot_path = tmp_path / "stac_cache.json"
+    cache = STACCache(ttl=3600, snapshot_path=str(snapshot_path), snapshot_interval=3600)
+    cache.get("first", lambda: 1)
+    cache.get("second", lambda: 2)
+
+    # the second entry waits for the next write
+    assert json.loads(snapshot_path.read_text()).keys() == {"first"}
+    cache.flush()
+    assert json.loads(snapshot_path.read_text()).keys() == {"first", "second"}
+    assert list(tmp_path.iterdir()) == [snapshot_path]
+
+
+def test_query_items_selects_intersecting_items(monkeypatch):
+    from datetime import datetime
+
+    import pystac
+    import shapely
+    from report.utils import stac
+
+    monkeypatch.setattr(stac, "stac_cache", stac.STACCache())
+    extent = pystac.Extent(
+        pystac.SpatialExtent([[0, 0, 3, 1]]), pystac.TemporalExtent([[datetime(2020, 1, 1), None]])
+    )
+    collection = pystac.Collection(id="tiles", description="tiles", extent=extent)
+    for x in range(3):
+        item = pystac.Item(
+            id=f"tile-{x}",
+            geometry=shapely.geometry.mapping(shapely.box(x, 0, x + 1, 1)),
+            bbox=[x, 0, x + 1, 1],
+            datetime=datetime(2020, 1, 1),
+            properties={},
+        )
+        item.add_asset("data", pystac.Asset(href=f"https://example.com/tile-{x}.zarr"))
+        collection.add_item(item)
+    client = stac.STACClientGCA(id="gca", description="gca")
+    client.add_child(collection)
+
+    items = client.query_items("tiles", shapely.box(0.5, 0.2, 1.5, 0.8))
+    assert [item.item_id for item in items] == ["tile-0", "tile-1"]
+    assert items[1].href == "https://example.com/tile-1.zarr"
+
+    # answered from the index without walking the catalog again
+    monkeypatch.setattr(client, "get_item_bboxes", None)
+    items = client.query_items("tiles", shapely.box(2.2, 0.2, 2.8, 0.8))
+    assert [item.item_id for item in items] == ["tile-2"]
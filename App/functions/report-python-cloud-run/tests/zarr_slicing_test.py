@@ -0,0 +1,156 @@
+import numpy as np
+import shapely
+import xarray as xr
+
+
+def test_slice_raster_masks_cells_outside_polygon():
+    from report.utils.zarr_slicing import ZarrSlicer
+
+    lons = np.arange(0, 10, 1.0)
+    lats = np.arange(10, 0, -1.0)
+    xarr = xr.Dataset(
+        {"value": (("lat", "lon"), np.ones((len(lats), len(lons))))},
+        coords={"lat": lats, "lon": lons},
+    )
+    polygon = shapely.Polygon([(1.5, 2.5), (5.5, 2.5), (1.5, 6.5), (1.5, 2.5)])
+
+    sliced = ZarrSlicer.slice_xarr_with_polygon(xarr, polygon)
+
+    # window is bounded by the cells inside the polygon
+    assert sliced.lon.values.tolist() == [2.0, 3.0, 4.0]
+    assert sliced.lat.values.tolist() == [5.0, 4.0, 3.0]
+    # cells in the window but outside the triangle are masked
+    expected = shapely.contains_xy(polygon, *np.meshgrid(sliced.lon, sliced.lat))
+    assert (sliced["value"].notnull().values == expected).all()
+
+
+def test_slice_raster_keeps_integer_classes():
+    from report.utils.zarr_slicing import ZarrSlicer
+
+    classes = xr.DataArray(np.arange(9, dtype="int16").reshape(3, 3), dims=("lat", "lon"))
+    classes.encoding["_FillValue"] = -1
+    xarr = xr.Dataset(
+        {"class": classes, "count": (("lat", "lon"), np.ones((3, 3), dtype="int32"))},
+        coords={"lat": [0.0, 1.0, 2.0], "lon": [0.0, 1.0, 2.0]},
+    )
+    polygon = shapely.Polygon([(-0.5, -0.5), (3, -0.5), (-0.5, 3), (-0.5, -0.5)])
+
+    sliced = ZarrSlicer._slice(xarr, polygon)
+
+    assert sliced["class"].dtype == "int16"
+    assert sliced["class"].values.tolist() == [[0, 1, 2], [3, 4, -1], [6, -1, -1]]
+    # without a fill value the cells are masked with NaN
+    assert sliced["count"].isnull().values.sum() == 3
+
+
+def test_slice_raster_outside_extent_is_empty():
+    from report.utils.zarr_slicing import ZarrSlicer
+
+    xarr = xr.Dataset(
+        {"value": (("lat", "lon"), np.ones((3, 3)))},
+        coords={"lat": [0.0, 1.0, 2.0], "lon": [0.0, 1.0, 2.0]},
+    )
+    polygon = shapely.box(20, 20, 21, 21)
+
+    sliced = ZarrSlicer.slice_xarr_with_polygon(xarr, polygon)
+
+    assert not ZarrSlicer.check_xarr_contains_data(sliced)
+
+
+def test_slice_points_with_station_index():
+    from report.utils.zarr_slicing import StationIndex, ZarrSlicer
+
+    xarr = xr.Dataset(
+        {"changerate": ("stations", np.arange(5.0))},
+        coords={
+            "lon": ("stations", [0.0, 1.0, 2.0, 3.0, 4.0]),
+            "lat": ("stations", [0.0, 1.0, 2.0, 3.0, 4.0]),
+        },
+    )
+    polygon = shapely.box(0.5, 0.5, 3.5, 3.5)
+
+    indexed = ZarrSlicer.slice_xarr_with_polygon(
+        xarr, polygon, StationIndex(xarr.lon.values, xarr.lat.values)
+    )
+    brute_force = ZarrSlicer.slice_xarr_with_polygon(xarr, polygon)
+
+    assert indexed["changerate"].values.tolist() == [1.0, 2.0, 3.0]
+    assert indexed.equals(brute_force)
+
+
+def test_slice_loads_lazy_dataset_once():
+    from report.utils.zarr_slicing import StationIndex, ZarrSlicer
+
+    xarr = xr.Dataset(
+        {"changerate": ("stations", np.arange(6.0))},
+        coords={
+            "lon": ("stations", np.arange(6.0)),
+            "lat": ("stations", np.arange(6.0)),
+        },
+    ).chunk({"stations": 2})
+    polygon = shapely.box(0.5, 0.5, 4.5, 4.5)
+
+    sliced = ZarrSlicer.slice_xarr_with_polygon(
+        xarr, polygon, StationIndex(xarr.lon.values, xarr.lat.values)
+    )
+
+    assert all(isinstance(var.data, np.ndarray) for var in sliced.variables.values())
+    assert sliced["changerate"].values.tolist() == [1.0, 2.0, 3.0, 4.0]
+    # the source dataset stays lazy
+    assert xarr["changerate"].chunks is not None
+
+
+def test_multiscale_level_matches_polygon_extent():
+    from report.utils.zarr_slicing import ZarrSlicer
+
+    url = "https://example.com/world_pop.zarr"
+    multiscales = [
+        {"path": "multiscales/0", "cell_size": 0.01},
+        {"path": "multiscales/1", "cell_size": 0.05},
+        {"path": "multiscales/2", "cell_size": 0.25},
+    ]
+
+    # 0.5 degrees over 1000 pixels is finer than any level
+    small = shapely.box(0, 0, 0.5, 0.5)
+    assert ZarrSlicer.get_multiscale_url(url, multiscales, small) == url
+    # 60 degrees over 1000 pixels is 0.06 degrees per pixel
+    large = shapely.box(0, 0, 60, 20)
+    assert ZarrSlicer.get_multiscale_url(url, multiscales, large) == f"{url}/multiscales/1"
+    assert ZarrSlicer.get_multiscale_url(url, [], large) == url
+
+
+def write_stations(url: str, n: int):
+    xr.Dataset(
+        {"value": ("stations", np.ones(n))},
+        coords={"lon": ("stations", np.linspace(0, 1, n)), "lat": ("stations", np.linspace(0, 1, n))},
+    ).to_zarr(url, mode="w", consolidated=True)
+
+
+def test_station_index_is_rebuilt_for_rewritten_store(tmp_path, monkeypatch):
+    from report.utils import zarr_slicing
+
+    monkeypatch.setattr(zarr_slicing, "STATION_INDEX_DIR", tmp_path / "index")
+    url = str(tmp_path / "stations.zarr")
+
+    write_stations(url, 10)
+    assert len(zarr_slicing.get_station_index(url, zarr_slicing.ZarrStorePool()._open(url)).tree) == 10
+    # the rewritten store has a new namespace, so its stations are indexed anew
+    write_stations(url, 20)
+    assert len(zarr_slicing.get_station_index(url, zarr_slicing.ZarrStorePool()._open(url)).tree) == 20
+
+
+def test_station_coordinates_are_read_from_disk_cache(tmp_path, monkeypatch):
+    from report.utils import zarr_slicing
+
+    monkeypatch.setattr(zarr_slicing, "STATION_INDEX_DIR", tmp_path / "index")
+    url = str(tmp_path / "stations.zarr")
+    write_stations(url, 10)
+    zarr_slicing.ZarrStorePool()._open(url)
+
+    # without its coordinate chunks the store reads them as fill values
+    (tmp_path / "stations.zarr" / "lon" / "0").unlink()
+    (tmp_path / "stations.zarr" / "lat" / "0").unlink()
+    xarr = zarr_slicing.ZarrStorePool()._open(url)
+
+    assert xarr["lon"].values.tolist() == np.linspace(0, 1, 10).tolist()
+    assert xarr["lat"].values.tolist() == np.linspace(0, 1, 10).tolist()
@@ -33,6 +33,7 @@ from stac.utils import (
     get_mapbox_item_id,
     rm_special_characters,
 )
+from multiscales import MULTISCALES_FIELD, write_station_multiscales
 
 if __name__ == "__main__":
     # hard-coded input params at project level
@@ -69,6 +70,11 @@ if __name__ == "__main__":
         "stations",
     ]  # List of str; dims ignored by datacube
 
+    # pre-aggregated levels for reports of large areas, grid cell sizes in degrees;
+    # population of the aggregated stations is summed
+    MULTISCALE_CELL_SIZES = [0.01, 0.05, 0.25, 1.0]
+    MULTISCALE_AGGREGATIONS = {"pop_tot": "sum"}
+
     # hard-coded frontend properties
     STATIONS = "locationId"
     TYPE = "circle"
@@ -141,6 +147,11 @@ if __name__ == "__main__":
 
     title = ds.attrs.get("title", COLLECTION_ID)
 
+    # write multiscale levels into the zarr store
+    multiscales = write_station_multiscales(
+        ds, gcs_zarr_store, MULTISCALE_CELL_SIZES, MULTISCALE_AGGREGATIONS
+    )
+
     # load coclico data catalog
     catalog = Catalog.from_file(os.path.join(rel_root, STAC_DIR, "catalog.json"))
 
@@ -180,8 +191,10 @@ if __name__ == "__main__":
 
     # create stac collection per variable and add to dataset collection
     for var in VARIABLES:
-        # add zarr store as asset to stac_obj
-        collection.add_asset("data", gen_zarr_asset(title, gcs_api_zarr_store))
+        # add zarr store as asset to stac_obj, advertising its multiscale levels
+        zarr_asset = gen_zarr_asset(title, gcs_api_zarr_store)
+        zarr_asset.extra_fields[MULTISCALES_FIELD] = multiscales
+        collection.add_asset("data", zarr_asset)
 
         # stac items are generated per AdditionalDimension (non spatial)
         for dimcomb in dimcombs:
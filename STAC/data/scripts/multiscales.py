@@ -0,0 +1,97 @@
+"""Pre-aggregated multiscale levels of station datasets
+
+Each level bins the stations into a lon/lat grid of ``cell_size`` degrees and
+keeps one station per occupied cell, located at the mean position of its
+stations. The levels are written as standalone consolidated Zarr stores under
+``multiscales/<i>`` in the dataset store and advertised in STAC under the
+``gca:multiscales`` field of the data asset, for example
+
+    "gca:multiscales": [
+        {"path": "multiscales/0", "cell_size": 0.01},
+        {"path": "multiscales/1", "cell_size": 0.05},
+    ]
+
+The report draws the scatter layers of its figures from the coarsest level
+whose cells are still smaller than a pixel of the figure; statistics are
+computed from the full resolution store.
+"""
+import fsspec
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+MULTISCALES_FIELD = "gca:multiscales"
+
+
+def coarsen_stations(
+    ds: xr.Dataset, cell_size: float, aggregations: dict[str, str]
+) -> xr.Dataset:
+    """Aggregate the stations of ds per grid cell of cell_size degrees
+
+    Args:
+        ds (xr.Dataset): station dataset with 1D lon and lat coordinates
+        cell_size (float): size of the grid cells in degrees
+        aggregations (dict[str, str]): pandas aggregation per variable, e.g. "sum"
+
+    Returns:
+        xr.Dataset: dataset with a station per occupied cell and a "count"
+            variable holding the number of stations it aggregates
+    """
+    station_dim = ds["lon"].dims[0]
+    table = pd.DataFrame(
+        {
+            "lon": ds["lon"].values,
+            "lat": ds["lat"].values,
+            **{var: ds[var].values for var in aggregations},
+        }
+    ).dropna(subset=["lon", "lat"])
+    table["cell_x"] = np.floor(table["lon"] / cell_size).astype("int64")
+    table["cell_y"] = np.floor(table["lat"] / cell_size).astype("int64")
+
+    cells = table.groupby(["cell_x", "cell_y"], sort=True).agg(
+        lon=("lon", "mean"),
+        lat=("lat", "mean"),
+        count=("lon", "size"),
+        **{var: (var, how) for var, how in aggregations.items()},
+    )
+
+    data_vars = {
+        var: (station_dim, cells[var].values, {**ds[var].attrs, "aggregation": how})
+        for var, how in aggregations.items()
+    }
+    data_vars["count"] = (
+        station_dim,
+        cells["count"].values.astype("int32"),
+        {"long_name": "number of aggregated stations"},
+    )
+    return xr.Dataset(
+        data_vars,
+        coords={
+            "lon": (station_dim, cells["lon"].values, ds["lon"].attrs),
+            "lat": (station_dim, cells["lat"].values, ds["lat"].attrs),
+        },
+        attrs={**ds.attrs, "cell_size": cell_size},
+    )
+
+
+def write_station_multiscales(
+    ds: xr.Dataset,
+    zarr_store: str,
+    cell_sizes: list[float],
+    aggregations: dict[str, str],
+) -> list[dict]:
+    """Write the multiscale levels of ds into zarr_store
+
+    Returns:
+        list[dict]: STAC description of the levels, finest first
+    """
+    multiscales = []
+    for i, cell_size in enumerate(sorted(cell_sizes)):
+        path = f"multiscales/{i}"
+        level = coarsen_stations(ds, cell_size, aggregations)
+        level.to_zarr(
+            fsspec.get_mapper(f"{zarr_store}/{path}"), mode="w", consolidated=True
+        )
+        print(f"wrote {path}: {level.sizes} at {cell_size} degrees")
+        multiscales.append({"path": path, "cell_size": cell_size})
+    return multiscales